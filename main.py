@@ -1,72 +1,236 @@
+import asyncio
+import logging
 import signal
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Dict
+from functools import partial
+from typing import Any, Dict, List, NamedTuple, Optional
 
+import numpy as np
 import yaml
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 
+from src import engines, metrics
+from src.batching import MicroBatcher, Overloaded, decode_image
 from src.camera import Camera
-from src.engines import get_engine, FaceEngine
-from src.utils import Connection, DoorState, connection, load_users, setup_logger
+from src.config import classify_changes, stream_configs
+from src.pipeline import LatestGroup, Pipeline
+from src.profiling import Profiler
+from src.startup import Startup
+from src.streams import Stream
+from src.utils import Connection, DoorState, load_users, setup_logger
 
 templates = Jinja2Templates(directory="templates")
 
 CONFIG_FILE = "configs/config_current.yaml"
 config = {}
-face_engine: FaceEngine
-connection: Connection
-camera: Camera
+face_engine: Optional["engines.FaceEngine"] = None  # imported lazily, torch and facenet_pytorch load while the cameras open
+streams: Dict[str, Stream] = {}  # stream name -> camera, door connection and motion gate
 users: Dict[str, str]  # user ID -> name
 logger = None
 stop_event = threading.Event()  # graceful shutdown event
-thread = None
+state_lock = threading.Lock()  # held while a frame is processed, so component swaps are never seen half-done
+pipeline: Optional[Pipeline] = None
+frame_group: Optional[LatestGroup] = None
+batcher: Optional[MicroBatcher] = None  # micro-batches /recognize requests
+profiler = Profiler()  # profiles recognition iterations on request from /profile
+startup = Startup(['cameras', 'engine', 'pipeline'])  # phase timings and component readiness for /health and /ready
+
+CAPTURE_SECONDS = metrics.histogram('facegate_capture_seconds', "Camera read and resize time", ['stream'])
+RECOGNIZE_SECONDS = metrics.histogram('facegate_recognize_seconds', "Recognition time per batch of frames")
+RENDER_SECONDS = metrics.histogram('facegate_render_seconds', "Overlay render time", ['stream'])
+FRAMES = metrics.counter('facegate_frames_total', "Frames by outcome: recognized, or skipped by the motion gate",
+                         ['stream', 'result'])
+FACES = metrics.counter('facegate_faces_total', "Faces by outcome: recognized or unknown", ['stream', 'result'])
+FACES_PER_FRAME = metrics.histogram('facegate_faces_per_frame', "Faces found per recognized frame", ['stream'],
+                                    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16))
+STAGE_FPS = metrics.gauge('facegate_stage_fps', "Items processed per second by each pipeline stage", ['stage'])
+DROPPED = metrics.counter('facegate_frames_dropped_total', "Items replaced in a buffer before a stage took them",
+                          ['buffer'])
+FEED_CLIENTS = metrics.gauge('facegate_feed_clients', "Connected video feed viewers", ['stream'])
+DOORS_PENDING = metrics.gauge('facegate_door_commands_pending', "Door commands waiting to be sent", ['stream'])
+READY = metrics.gauge('facegate_ready', "1 once every component is started and the models are warmed up")
+STARTUP_SECONDS = metrics.gauge('facegate_startup_phase_seconds', "Duration of each startup phase", ['phase'])
+
+
+@metrics.collector
+def collect():
+    """Refresh the metrics kept by the pipeline and streams themselves"""
+    if pipeline:
+        for name, stage in list(pipeline.stages.items()):
+            STAGE_FPS.set(stage.stats()['fps'], stage=name)
+        for name, buffer in list(pipeline.buffers.items()):
+            DROPPED.set(buffer.dropped, buffer=name)
+    for name, stream in list(streams.items()):
+        FEED_CLIENTS.set(stream.broadcaster.clients, stream=name)
+        DOORS_PENDING.set(stream.doors.commands.qsize(), stream=name)
+    READY.set(int(startup.ready))
+    for name, phase in startup.report()['phases'].items():
+        if 'seconds' in phase:
+            STARTUP_SECONDS.set(phase['seconds'], phase=name)
+
+
+def load_models(config):
+    """Import the engine and load its weights (runs while the cameras are being opened)"""
+    with startup.phase('imports'):
+        engine_class = engines.engine_class(config)
+    with startup.phase('models'):
+        engine_class.preload(config)
+
+
+def detection_sizes(cameras):
+    """(width, height) of the frames and ROI crops the cameras hand to detection"""
+    sizes = []
+    for camera in cameras:
+        sizes.append((camera.frame_width, camera.frame_height))
+        roi = camera.detection_roi()
+        if roi is not None:
+            sizes.append((roi[2] - roi[0], roi[3] - roi[1]))
+    return sizes
 
 
 def init(config):
-    """Initialize all components with given config"""
-    global face_engine, camera, connection, users, logger, stop_event
+    """Initialize all components with given config, loading the models in parallel with opening the cameras"""
+    global face_engine, streams, users, logger, stop_event
 
     logger = setup_logger(config)
     logger.info("Updating config")
-    connection = Connection(config)
-    users = load_users(config)
-    camera = Camera(config, stop_event)
-    face_engine = get_engine(config, users, camera)
+    with ThreadPoolExecutor(1, thread_name_prefix='models') as executor:
+        models = executor.submit(load_models, config)
+        with startup.phase('users'):
+            users = load_users(config)
+        with startup.phase('cameras'):
+            streams = {name: Stream(name, stream_config, stop_event)
+                       for name, stream_config in stream_configs(config).items()}
+        startup.set_ready('cameras')
+        models.result()
+    with startup.phase('engine'):
+        face_engine = engines.get_engine(config, users, next(iter(streams.values())).camera)
+    # The first inferences pay for allocations and kernel selection, better here than on a person at the gate
+    with startup.phase('warmup'):
+        face_engine.warm_up(detection_sizes(stream.camera for stream in streams.values()))
+    startup.set_ready('engine')
+
+
+def start():
+    """Bring the service up in the background, so /health answers while models load; doors act only once ready"""
+    global pipeline, batcher
+
+    try:
+        init(config)
+        with startup.phase('pipeline'):
+            pipeline = build_pipeline()
+            pipeline.start()
+            batcher = MicroBatcher(recognize_images, config.get('recognize'), stop_event)
+        startup.set_ready('pipeline')
+        logger.info("Ready in %.2fs", startup.finished)
+    except Exception as exc:
+        logging.getLogger(__name__).exception("Startup failed: %s", exc)
+
+
+def apply_config(new_config):
+    """Apply a new config in place, rebuilding only the components whose settings changed"""
+    global config, face_engine, streams, users
+
+    start = time.perf_counter()
+    changes = classify_changes(config, new_config)
+    new_stream_configs = stream_configs(new_config)
+
+    # Heavy work happens before taking the lock, the pipeline keeps running on the old components
+    prepared, added = {}, {}
+    try:
+        for name, stream_config in new_stream_configs.items():
+            if name in streams:
+                prepared[name] = streams[name].prepare(stream_config)
+            else:
+                added[name] = Stream(name, stream_config, stop_event)
+        new_users = load_users(new_config) if changes & {'users', 'connection'} else users
+        new_engine, gallery = face_engine, None
+        if 'model' in changes:
+            cameras = [item[2] for item in prepared.values()] + [stream.camera for stream in added.values()]
+            new_engine = engines.get_engine(new_config, new_users, cameras[0])  # weights come from the process-wide cache
+            new_engine.warm_up(detection_sizes(cameras))
+        elif changes & {'gallery', 'users'}:
+            gallery = face_engine.load_embeddings(new_users, new_config)
+    except Exception:
+        for name, item in prepared.items():
+            streams[name].discard(item)
+        for stream in added.values():
+            stream.release()
+        raise
+
+    with state_lock:
+        for name, item in prepared.items():
+            streams[name].commit(item)
+        removed = [stream for name, stream in streams.items() if name not in new_stream_configs]
+        streams = {name: streams.get(name) or added[name] for name in new_stream_configs}
+        old_engine = face_engine
+        config, users, face_engine = new_config, new_users, new_engine
+        face_engine.apply_config(new_config, gallery)
+        for stream in removed:
+            face_engine.remove_stream(stream.name)
+        stopped = {}
+        if pipeline:
+            for stream in removed:
+                stopped[stream.name] = remove_stream_stages(pipeline, stream)
+            for stream in added.values():
+                add_stream_stages(pipeline, stream)
+    if pipeline:
+        pipeline.start()
+    if batcher and 'api' in changes:
+        batcher.configure(new_config.get('recognize'))
+    if not pipeline:
+        for name in prepared:
+            streams[name].release_retired()  # no capture stage reads them
+    for stream in removed:
+        release_stream(stream, stopped.get(stream.name, {}))
+    if face_engine is not old_engine:
+        old_engine.close()
+
+    elapsed = round(time.perf_counter() - start, 4)
+    logger.info("Config applied (%s) in %.3fs", ", ".join(sorted(changes)) or "no changes", elapsed)
+    return sorted(changes), elapsed
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global config, stop_event, thread
+    global config
 
     with open(CONFIG_FILE, "r") as file:
         config = yaml.safe_load(file)
 
-    init(config)
-    thread = threading.Thread(target=capture_loop, daemon=True)
-    thread.start()
+    threading.Thread(target=start, name='startup', daemon=True).start()
     try:
         yield
     finally:
-        logger.info("App stopped")
+        if logger:
+            logger.info("App stopped")
 
 
 app = FastAPI(lifespan=lifespan)
 
 
 def handle_exit(*args):
-    global stop_event, thread, camera
+    global stop_event, pipeline, streams
 
-    logger.info("Shutting down...")
+    if logger:
+        logger.info("Shutting down...")
     stop_event.set()
-    if thread and thread.is_alive():
-        thread.join(timeout=2)
-    if camera:
-        camera.release()
+    if pipeline:
+        pipeline.join(timeout=2)
+    if batcher:
+        batcher.close()
+    for stream in streams.values():
+        stream.release()
+    if face_engine:
+        face_engine.close()
 
     orig_handler(*args)
 
@@ -74,56 +238,173 @@ def handle_exit(*args):
 orig_handler = signal.signal(signal.SIGINT, handle_exit)
 
 
-def capture_loop():
-    """Main capture loop - processes frames and controls doors"""
-    while not stop_event.is_set():
-        try:
-            ret, new_frame = camera.video_capture()
-        except Exception as exc:
-            logger.exception("Error capturing frame: %s", exc)
-            continue
+class Detection(NamedTuple):
+    """Recognition result for one frame with the components it was produced with"""
+    camera: Camera
+    frame: Any
+    user_ids: list
+    face_locations: Any
+    users: Dict[str, str]
+    connection: Connection
+    config: dict
 
-        if not ret:
-            continue
 
+def grab_frame(stream):
+    """Capture stage - reads the next frame from the stream's current camera"""
+    stream.release_retired()  # cameras replaced by /config, no longer read now that the last read returned
+    current_camera = stream.camera
+    start = time.perf_counter()
+    try:
+        ret, new_frame = current_camera.video_capture()
+    except Exception as exc:
+        logger.exception("Error capturing frame on %s: %s", stream.name, exc)
+        return None
+    CAPTURE_SECONDS.observe(time.perf_counter() - start, stream=stream.name)
+    return (current_camera, new_frame) if ret else None
+
+
+def recognize(items):
+    """Recognition stage - detects and identifies faces on the freshest frame of every stream in one batch"""
+    with state_lock, profiler.iteration():
+        batch = []
+        for name, (frame_camera, frame) in items.items():
+            stream = streams.get(name)
+            if stream is None or frame_camera is not stream.camera:
+                continue  # captured before the stream or its camera was replaced
+            camera = stream.camera
+            if frame.shape[:2] != (camera.frame_height, camera.frame_width):
+                continue  # captured before a frame size change
+
+            if stream.motion_gate.should_process(frame, [camera.exit_area, camera.entrance_area]):
+                batch.append((stream, frame))
+            else:
+                FRAMES.inc(stream=name, result='skipped')
+                # Static scene: skip detection but still pass the frame on so the video feed stays live
+                publish(stream, Detection(camera, frame, [], [], users, stream.connection, stream.config))
+
+        if not batch:
+            return None
+        start = time.perf_counter()
         try:
-            frame = new_frame
-            user_ids, face_locations = face_engine.detect_faces(frame)
+            results = face_engine.detect_faces_batch([frame for _, frame in batch],
+                                                     [stream.camera.detection_roi() for stream, _ in batch],
+                                                     [stream.name for stream, _ in batch],
+                                                     [stream.camera.min_face_size() for stream, _ in batch],
+                                                     [stream.camera.overview() for stream, _ in batch])
         except Exception as exc:
             logger.exception("Error running face detection: %s", exc)
-            continue
+            return None
+        RECOGNIZE_SECONDS.observe(time.perf_counter() - start)
+        for (stream, frame), (user_ids, face_locations) in zip(batch, results):
+            stream.motion_gate.report(len(face_locations))
+            recognized = sum(1 for user_id in user_ids if user_id != 0)
+            FRAMES.inc(stream=stream.name, result='recognized')
+            FACES_PER_FRAME.observe(len(user_ids), stream=stream.name)
+            FACES.inc(recognized, stream=stream.name, result='recognized')
+            FACES.inc(len(user_ids) - recognized, stream=stream.name, result='unknown')
+            publish(stream, Detection(stream.camera, frame, user_ids, face_locations, users, stream.connection,
+                                      stream.config))
+    return None
 
-        try:
-            open_n, door_state = camera.check_areas(face_locations, user_ids)
-
-            if door_state != DoorState.CLOSED and open_n is not None:
-                user_id = user_ids[open_n]
-                user_name = users.get(user_id, users.get(0, "Unknown"))
-                logger.info(f'Door {door_state} opened for {user_name}')
-                if config.get("test_mode"):
-                    print(f'Door {door_state} opened for {user_name}')
-                else:
-                    connection.open_doors(user_id, door_state, user_name)
-            camera.show(face_locations, user_ids, users)
-        except Exception as exc:
-            logger.exception("Error processing frame overlay or door logic: %s", exc)
-    logger.info("Loop exited")
+
+def recognize_images(images):
+    """Micro-batch stage of /recognize - runs on the engine current at the time of the batch"""
+    return face_engine.recognize_images(images)
+
+
+def publish(stream, detection):
+    stream.detections.put(detection)
+    stream.overlays.put(detection)
+
+
+def decide(stream, detection):
+    """Decision stage - hands a door command for a recognized face inside a turnstile zone to the dispatcher"""
+    try:
+        user_ids = detection.user_ids
+        open_n, door_state = detection.camera.check_areas(detection.face_locations, user_ids)
+
+        if door_state != DoorState.CLOSED and open_n is not None:
+            user_id = user_ids[open_n]
+            user_name = detection.users.get(user_id, detection.users.get(0, "Unknown"))
+            logger.info(f'Door {door_state} opened for {user_name}')
+            if detection.config.get("test_mode"):
+                print(f'Door {door_state} opened for {user_name}')
+            else:
+                stream.doors.submit(detection.connection, user_id, door_state, user_name)
+    except Exception as exc:
+        logger.exception("Error processing door logic: %s", exc)
+
+
+def render(stream, detection):
+    """Render stage - draws zones and recognized faces and hands the frame to the video feed"""
+    if not stream.broadcaster.wants_frame():
+        return None  # nobody is watching, or the feed is at max_fps already
+    try:
+        with RENDER_SECONDS.time(stream=stream.name):
+            frame = detection.camera.show(detection.face_locations, detection.user_ids, detection.users,
+                                          detection.frame)
+        stream.broadcaster.encode(frame)  # wants_frame was checked above
+    except Exception as exc:
+        logger.exception("Error processing frame overlay: %s", exc)
+
+
+def add_stream_stages(stages, stream):
+    """Per-stream capture, decision and render stages around the shared recognition stage"""
+    stream.frames = stages.buffer(f'frames-{stream.name}')
+    stream.detections = stages.buffer(f'detections-{stream.name}')
+    stream.overlays = stages.buffer(f'overlays-{stream.name}')
+    frame_group.add(stream.name, stream.frames)
+    stages.stage(f'grab-{stream.name}', partial(grab_frame, stream), outputs=[stream.frames])
+    stages.stage(f'decide-{stream.name}', partial(decide, stream), stream.detections)
+    stages.stage(f'render-{stream.name}', partial(render, stream), stream.overlays)
+
+
+def remove_stream_stages(stages, stream):
+    """Stop the stream's stages and drop its buffers; returns the stopped stages by name"""
+    frame_group.remove(stream.name)
+    return stages.remove([f'{stage}-{stream.name}' for stage in ('grab', 'decide', 'render')],
+                  [f'{buffer}-{stream.name}' for buffer in ('frames', 'detections', 'overlays')])
+
+
+def release_stream(stream, stages):
+    """Release a removed stream once its stopped stages have exited; what a stage still running uses stays open"""
+    running = {name for name, stage in stages.items() if not stage.join(timeout=2)}
+    if running:
+        logger.warning("Stages %s of removed stream %s did not exit, leaving what they use open",
+                       ", ".join(sorted(running)), stream.name)
+    stream.release(camera=f'grab-{stream.name}' not in running, doors=f'decide-{stream.name}' not in running)
+
+
+def build_pipeline():
+    """Capture per stream -> one batched recognize -> (decide, render) per stream, always on the freshest items"""
+    global frame_group
+
+    stages = Pipeline(stop_event)
+    frame_group = LatestGroup('frames')
+    stages.stage('recognize', recognize, frame_group)
+    for stream in streams.values():
+        add_stream_stages(stages, stream)
+    return stages
+
+
+def require_ready():
+    if not startup.ready:
+        raise HTTPException(status_code=503, detail=f"Service is {startup.report()['status']}")
 
 
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
-    return templates.TemplateResponse("camera.html", {"request": request})
+    return templates.TemplateResponse(request, "camera.html", {"streams": list(streams)})
 
 
 @app.post("/config")
 async def set_config(config_file: UploadFile = File(...)):
-    """Upload and apply new configuration"""
-    global config
-
+    """Upload and apply new configuration, rebuilding only what the changes affect"""
+    require_ready()
     try:
         raw_data = await config_file.read()
-        config = yaml.safe_load(raw_data)
-        init(config)
+        new_config = yaml.safe_load(raw_data)
+        changes, elapsed = await run_in_threadpool(apply_config, new_config)
 
         with open(CONFIG_FILE, "wb") as f:
             f.write(raw_data)
@@ -133,23 +414,135 @@ async def set_config(config_file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {e}")
 
-    return {"filename": config_file.filename, "message": "Config updated"}
+    return {"filename": config_file.filename, "message": "Config updated", "changes": changes, "elapsed": elapsed}
+
+
+def sync_users():
+    """Reload users and bring the engine's gallery in line, swapping it under state_lock"""
+    global users
+
+    new_users = load_users(config)
+    engine = face_engine
+    report = engine.sync(new_users, state_lock)
+    with state_lock:
+        if face_engine is engine:  # a config change that replaced the engine also reloaded the users
+            users = new_users
+    return report
 
 
 @app.post("/sync")
 async def sync():
-    """Synchronize users and embeddings from database"""
+    """Synchronize users and embeddings from database, updating only changed identities"""
+    require_ready()
     try:
-        init(config)
+        report = await run_in_threadpool(sync_users)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {e}")
-    return {"message": "Data synchronized"}
+    return {"message": "Data synchronized", **report}
+
+
+@app.get("/stats")
+def stats():
+    """Per-stage throughput and latency, buffer depth, dropped frames, and motion gate, feed, door and tracker counts"""
+    require_ready()
+    result = pipeline.stats()
+    result['motion'] = {name: stream.motion_gate.stats() for name, stream in list(streams.items())}
+    result['feeds'] = {name: stream.broadcaster.stats() for name, stream in list(streams.items())}
+    result['doors'] = {name: stream.doors.stats() for name, stream in list(streams.items())}
+    result['tracker'] = face_engine.stats()
+    result['recognize'] = batcher.stats()
+    return result
+
+
+@app.post("/recognize")
+async def recognize_uploads(images: List[UploadFile] = File(...)):
+    """Recognize faces on uploaded images, batched with concurrent requests; returns IDs, names, boxes and distances"""
+    require_ready()
+    if len(images) > batcher.settings['max_images']:
+        raise HTTPException(status_code=413, detail=f"At most {batcher.settings['max_images']} images per request")
+    decoded = []
+    for upload in images:
+        image = await run_in_threadpool(decode_image, await upload.read(), batcher.settings['max_size'])
+        if image is None:
+            raise HTTPException(status_code=422, detail=f"Cannot decode image {upload.filename}")
+        decoded.append(image)
+
+    start = time.perf_counter()
+    try:
+        future = batcher.submit([image for image, _ in decoded])
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    try:
+        results = await asyncio.wrap_future(future)
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error recognizing images: {e}")
+
+    current_users = users
+    response = []
+    for upload, (_, scale), (user_ids, boxes, distances) in zip(images, decoded, results):
+        response.append({"filename": upload.filename, "faces": [
+            {"user_id": user_id, "name": current_users.get(user_id, current_users.get(0, "Unknown")),
+             "box": [round(float(value) / scale, 1) for value in box],
+             "distance": round(float(distance), 4) if np.isfinite(distance) else None}
+            for user_id, box, distance in zip(user_ids, boxes, distances)]})
+    return {"images": response, "elapsed": round(time.perf_counter() - start, 4)}
+
+
+@app.post("/profile")
+async def profile(iterations: int = 50, torch_profile: bool = True, timeout: float = 300):
+    """Profile the next iterations of the recognition stage and return a zip report"""
+    require_ready()
+    if iterations < 1:
+        raise HTTPException(status_code=422, detail="iterations must be positive")
+    try:
+        session = profiler.start(iterations, torch_profile)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if not await run_in_threadpool(session.done.wait, timeout):
+        profiler.cancel(session)
+        if not await run_in_threadpool(session.done.wait, 5):
+            raise HTTPException(status_code=504, detail="No recognition iterations ran within the timeout")
+    filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.zip"
+    return Response(await run_in_threadpool(session.archive), media_type="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Counters and latency histograms in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def stream_video(name):
+    require_ready()
+    if name not in streams:
+        raise HTTPException(status_code=404, detail=f"Unknown stream: {name}")
+    return StreamingResponse(streams[name].broadcaster.stream(), media_type="multipart/x-mixed-replace; boundary=frame")
+
+
+@app.get("/health")
+def health():
+    """Liveness: always answers, with component readiness and the time each startup phase took"""
+    return startup.report()
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once cameras are open, models are warmed up and recognition runs, 503 until then"""
+    return JSONResponse(startup.report(), status_code=200 if startup.ready else 503)
 
 
 @app.get("/video_feed")
 def video_feed():
-    """Stream video feed to web interface"""
-    try:
-        return StreamingResponse(camera.generate(), media_type="multipart/x-mixed-replace; boundary=frame")
-    except Exception as e:
-        return {"error": str(e)}
+    """Stream video feed of the first camera to web interface"""
+    require_ready()
+    return stream_video(next(iter(streams)))
+
+
+@app.get("/video_feed/{name}")
+def stream_feed(name: str):
+    """Stream video feed of the named camera to web interface"""
+    return stream_video(name)
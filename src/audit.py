@@ -0,0 +1,251 @@
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+import torch
+import yaml
+
+from src.camera import Camera
+from src.engines import get_engine
+from src.motion import MotionGate
+from src.utils import DoorState, load_users
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.ts', '.mpg', '.mpeg', '.webm')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchCapture:
+    """cv2.VideoCapture-like reader of a video file or image sequence that decodes ahead in a background thread.
+
+    Items are (frame index, seconds since the start, frame); with a stride only every n-th frame is decoded.
+    """
+
+    def __init__(self, path, images=None, depth=64, stride=1, fps=25.0):
+        self.path = path
+        self.images = images  # image sequence instead of a video file
+        self.stride = stride
+        self.items = queue.Queue(depth)
+        self.closed = False
+        if images is None:
+            self.cap = cv2.VideoCapture(path)
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or fps
+            self.size = (self.cap.get(cv2.CAP_PROP_FRAME_WIDTH), self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        else:
+            self.cap = None
+            self.fps = fps
+            first = cv2.imread(images[0]) if images else None
+            self.size = (first.shape[1], first.shape[0]) if first is not None else (0, 0)
+        self.thread = threading.Thread(target=self.run, name=f'decode-{os.path.basename(path)}', daemon=True)
+        self.thread.start()
+
+    def frames(self):
+        if self.images is not None:
+            for index in range(0, len(self.images), self.stride):
+                frame = cv2.imread(self.images[index])
+                if frame is not None:
+                    yield index, index / self.fps, frame
+            return
+
+        index = 0
+        while self.cap.grab():  # skipped frames are grabbed but not decoded
+            if index % self.stride == 0:
+                ok, frame = self.cap.retrieve()
+                if ok:
+                    yield index, index / self.fps, frame
+            index += 1
+        self.cap.release()
+
+    def run(self):
+        for item in self.frames():
+            while not self.closed:
+                try:
+                    self.items.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if self.closed:
+                return
+        self.items.put(None)
+
+    def next(self):
+        """Next decoded item, or None at the end"""
+        return self.items.get()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.size[0]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.size[1]
+        return 0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.closed = True
+
+
+class Source:
+    """One recording with its zones and motion gate"""
+
+    def __init__(self, name, capture, config, stop_event):
+        self.name = name
+        self.capture = capture
+        self.camera = Camera(config, stop_event, capture)
+        self.motion_gate = MotionGate(config)
+        self.roi = self.camera.detection_roi()
+        self.last_event = None  # (user ID, seconds) of the last door event, for min_time_diff
+        self.frames = 0
+        self.seconds = 0.0
+
+    def next_frame(self):
+        item = self.capture.next()
+        if item is None:
+            return None
+        index, seconds, frame = item
+        if frame.shape[:2] != (self.camera.frame_height, self.camera.frame_width):
+            frame = cv2.resize(frame, (self.camera.frame_width, self.camera.frame_height))
+        self.frames += 1
+        self.seconds = seconds
+        return index, seconds, frame
+
+
+def find_sources(paths):
+    """(name, video path or None, image paths or None) for each video file and each folder of images"""
+    sources = []
+    for path in paths:
+        if os.path.isfile(path):
+            sources.append((path, path, None))
+            continue
+        files = sorted(p for p in glob.glob(os.path.join(path, '*')) if os.path.isfile(p))
+        sources += [(p, p, None) for p in files if p.lower().endswith(VIDEO_EXTENSIONS)]
+        images = [p for p in files if p.lower().endswith(IMAGE_EXTENSIONS)]
+        if images:
+            sources.append((path, path, images))
+    return sources
+
+
+class Audit:
+    """Runs recognition over recordings without real-time pacing and writes the door events it would trigger.
+
+    Several recordings are decoded in parallel and their frames recognized together in batches, as
+    camera streams of one engine; door events are de-duplicated with min_time_diff on video time.
+    """
+
+    def __init__(self, config, engine, users, parallel=4, batch_size=8, stride=1, prefetch=64, fps=25.0):
+        self.config = config
+        self.engine = engine
+        self.users = users
+        self.parallel = parallel
+        self.batch_size = batch_size
+        self.stride = stride
+        self.prefetch = prefetch
+        self.fps = fps
+        self.stop_event = threading.Event()
+
+    def open(self, name, path, images):
+        capture = PrefetchCapture(path, images, self.prefetch, self.stride, self.fps)
+        return Source(name, capture, self.config, self.stop_event)
+
+    def door_event(self, source, seconds, user_ids, face_locations):
+        """Door event the live decide stage would send for this frame, or None"""
+        open_n, door_state = source.camera.check_areas(face_locations, user_ids)
+        if door_state == DoorState.CLOSED or open_n is None:
+            return None
+        user_id = user_ids[open_n]
+        if source.last_event and source.last_event[0] == user_id and \
+                seconds - source.last_event[1] <= self.config['turnstiles']['min_time_diff']:
+            return None
+        source.last_event = (user_id, seconds)
+        return {'source': source.name, 'time': round(seconds, 3), 'user_id': user_id,
+                'user_name': self.users.get(user_id, self.users.get(0)), 'zone': door_state.name.lower()}
+
+    def run(self, paths, writer):
+        """Process all recordings, writing door events as rows to the csv writer; returns a summary"""
+        start = time.perf_counter()
+        pending = find_sources(paths)
+        active, done = [], []
+        events = frames = 0
+        per_source = max(self.batch_size // max(self.parallel, 1), 1)
+
+        while pending or active:
+            while pending and len(active) < self.parallel:
+                active.append(self.open(*pending.pop(0)))
+
+            batch = []
+            for source in list(active):
+                for _ in range(per_source):
+                    item = source.next_frame()
+                    if item is None:
+                        active.remove(source)
+                        done.append(source)
+                        logger.info("Finished %s: %d frames, %.1fs of video", source.name, source.frames, source.seconds)
+                        break
+                    index, seconds, frame = item
+                    regions = [source.camera.exit_area, source.camera.entrance_area]
+                    if source.motion_gate.should_process(frame, regions, seconds):
+                        batch.append((source, index, seconds, frame))
+            if not batch:
+                continue
+
+            results = self.engine.detect_faces_batch([item[3] for item in batch], [item[0].roi for item in batch],
+                                                     [item[0].name for item in batch],
+                                                     [item[0].camera.min_face_size() for item in batch],
+                                                     [item[0].camera.overview() for item in batch])
+            frames += len(batch)
+            for (source, index, seconds, _), (user_ids, face_locations) in zip(batch, results):
+                source.motion_gate.report(len(face_locations), seconds)
+                event = self.door_event(source, seconds, user_ids, face_locations)
+                if event:
+                    writer.writerow({**event, 'frame': index})
+                    events += 1
+
+        for source in done:
+            self.engine.remove_stream(source.name)
+        elapsed = time.perf_counter() - start
+        video_seconds = sum(source.seconds for source in done)
+        return {
+            'sources': len(done),
+            'frames_read': sum(source.frames for source in done),
+            'frames_recognized': frames,
+            'video_seconds': round(video_seconds, 2),
+            'events': events,
+            'elapsed': round(elapsed, 2),
+            'speed': round(video_seconds / elapsed, 2) if elapsed > 0 else 0.0,  # times real time
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recognize faces in recordings and write the door events to a CSV")
+    parser.add_argument('paths', nargs='+', help="Video files, or folders of videos or of image sequences")
+    parser.add_argument('--config', default='configs/config_current.yaml')
+    parser.add_argument('--output', default='audit_events.csv')
+    parser.add_argument('--parallel', type=int, default=4, help="Recordings decoded and recognized together")
+    parser.add_argument('--batch-size', type=int, default=8, help="Frames per detection and embedding batch")
+    parser.add_argument('--stride', type=int, default=1, help="Recognize every n-th frame")
+    parser.add_argument('--prefetch', type=int, default=64, help="Decoded frames buffered per recording")
+    parser.add_argument('--fps', type=float, default=25.0, help="Frame rate of image sequences")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    torch.set_grad_enabled(False)
+    users = load_users(config)
+    engine = get_engine(config, users, None)
+    audit = Audit(config, engine, users, args.parallel, args.batch_size, args.stride, args.prefetch, args.fps)
+
+    with open(args.output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, ['source', 'frame', 'time', 'user_id', 'user_name', 'zone'])
+        writer.writeheader()
+        summary = audit.run(args.paths, writer)
+    print(json.dumps(summary, indent=1))
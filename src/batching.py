@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {'max_batch': 16, 'max_wait_ms': 10, 'max_pending': 64, 'max_images': 16, 'max_size': 1280,
+            'max_share': 0.25, 'timeout': 10.0}
+
+REQUESTS = metrics.counter('facegate_recognize_requests_total',
+                           "/recognize requests by outcome: ok, rejected (queue full), expired or failed", ['result'])
+BATCH_IMAGES = metrics.histogram('facegate_recognize_batch_images', "Images per micro-batch of /recognize requests",
+                                 buckets=(1, 2, 4, 8, 16, 32, 64))
+QUEUE_SECONDS = metrics.histogram('facegate_recognize_queue_seconds', "Time a /recognize request waited for its batch")
+BATCH_SECONDS = metrics.histogram('facegate_recognize_batch_seconds', "Inference time per micro-batch")
+
+
+def decode_image(data, max_size):
+    """RGB image from encoded bytes, downscaled to at most max_size pixels per side; returns (image, scale) or None"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    scale = min(max_size / max(image.shape[:2]), 1.0) if max_size else 1.0
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), scale  # RGB like the enrollment photos
+
+
+class Overloaded(RuntimeError):
+    """The scheduler's queue is full, the client should retry later"""
+
+
+class Pending:
+    """Images of one request with the future its results are delivered to"""
+
+    def __init__(self, images, deadline):
+        self.images = images
+        self.deadline = deadline
+        self.queued = time.perf_counter()
+        self.future = Future()
+
+
+class MicroBatcher:
+    """Collects recognition requests for a few milliseconds and runs them through the engine as one batch.
+
+    `run_batch(images)` returns one result per image. Back-pressure keeps the live gate first: the queue
+    holds at most `max_pending` images (more are rejected with Overloaded), requests expire after
+    `timeout` seconds, and after each batch the scheduler idles so that it uses at most `max_share` of
+    the time, leaving the rest to the camera pipeline.
+    """
+
+    def __init__(self, run_batch, settings, stop_event):
+        self.run_batch = run_batch
+        self.settings = {**DEFAULTS, **(settings or {})}
+        self.stop_event = stop_event
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.pending_images = 0
+        self.resume = 0.0  # perf_counter time before which no batch may start, from max_share
+        self.closed = False
+        self.batches = 0
+        self.images = 0
+        self.rejected = 0
+        self.expired = 0
+        self.batch_sizes = deque(maxlen=500)
+        self.latencies = deque(maxlen=500)  # seconds from submit to result, most recent
+        self.thread = threading.Thread(target=self.run, name='recognize-batcher', daemon=True)
+        self.thread.start()
+
+    def configure(self, settings):
+        """Apply new limits; requests already queued keep their deadline"""
+        self.settings = {**DEFAULTS, **(settings or {})}
+
+    def submit(self, images):
+        """Queue images for recognition; returns a Future of their results, raises Overloaded if the queue is full"""
+        if len(images) > self.settings['max_images']:
+            raise ValueError(f"At most {self.settings['max_images']} images per request")
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Recognition scheduler is stopped")
+            if self.pending_images + len(images) > self.settings['max_pending']:
+                self.rejected += 1
+                REQUESTS.inc(result='rejected')
+                raise Overloaded(f"{self.pending_images} images are waiting already")
+            pending = Pending(images, time.perf_counter() + self.settings['timeout'])
+            self.queue.append(pending)
+            self.pending_images += len(images)
+            self.condition.notify()
+        return pending.future
+
+    def next_batch(self):
+        """Wait for a request, then up to max_wait_ms for more, and take requests with at most max_batch images"""
+        with self.condition:
+            while not self.queue:
+                if self.stop_event.is_set() or self.closed:
+                    return None
+                self.condition.wait(0.1)
+            # Gather from the first request on, but never start before the share of the last batch is paid back
+            gather_until = max(self.queue[0].queued + self.settings['max_wait_ms'] / 1000, self.resume)
+            while sum(len(item.images) for item in self.queue) < self.settings['max_batch']:
+                remaining = gather_until - time.perf_counter()
+                if remaining <= 0 or self.stop_event.is_set() or self.closed:
+                    break
+                self.condition.wait(remaining)
+            while time.perf_counter() < self.resume and not (self.stop_event.is_set() or self.closed):
+                self.condition.wait(self.resume - time.perf_counter())
+
+            batch, size, now = [], 0, time.perf_counter()
+            while self.queue and (not batch or size + len(self.queue[0].images) <= self.settings['max_batch']):
+                item = self.queue.popleft()
+                self.pending_images -= len(item.images)
+                if now > item.deadline or not item.future.set_running_or_notify_cancel():
+                    self.expire(item)
+                    continue
+                batch.append(item)
+                size += len(item.images)
+            return batch
+
+    def expire(self, item):
+        self.expired += 1
+        REQUESTS.inc(result='expired')
+        if not item.future.cancelled():
+            item.future.set_exception(TimeoutError("Request expired in the recognition queue"))
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+            if not batch:
+                continue
+            images = [image for item in batch for image in item.images]
+            start = time.perf_counter()
+            for item in batch:
+                QUEUE_SECONDS.observe(start - item.queued)
+            try:
+                results = self.run_batch(images)
+            except Exception as exc:
+                logger.exception("Recognition batch of %d images failed: %s", len(images), exc)
+                for item in batch:
+                    REQUESTS.inc(result='failed')
+                    item.future.set_exception(exc)
+                continue
+            finally:
+                elapsed = time.perf_counter() - start
+                BATCH_SECONDS.observe(elapsed)
+                share = self.settings['max_share']
+                self.resume = time.perf_counter() + elapsed * (1 - share) / share
+
+            self.batches += 1
+            self.images += len(images)
+            self.batch_sizes.append(len(images))
+            BATCH_IMAGES.observe(len(images))
+            offset, done = 0, time.perf_counter()
+            for item in batch:
+                item.future.set_result(results[offset:offset + len(item.images)])
+                offset += len(item.images)
+                self.latencies.append(done - item.queued)
+                REQUESTS.inc(result='ok')
+
+    def close(self):
+        """Stop the scheduler, failing the requests still queued"""
+        with self.condition:
+            self.closed = True
+            queued, self.queue = list(self.queue), deque()
+            self.pending_images = 0
+            self.condition.notify_all()
+        for item in queued:
+            if item.future.set_running_or_notify_cancel():
+                item.future.set_exception(RuntimeError("Recognition scheduler is stopped"))
+        self.thread.join(timeout=2)
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'batches': self.batches,
+            'images': self.images,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'pending_images': self.pending_images,
+            'mean_batch': round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0.0,
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else 0.0,
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2) if len(latencies) else 0.0,
+        }
@@ -0,0 +1,226 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import torch
+import yaml
+
+from src.broadcast import FrameBroadcaster
+from src.camera import Camera
+from src.engines import get_engine
+from src.engines.gallery import Gallery
+from src.engines.index import get_index
+from src.engines.store import EmbeddingStore
+
+
+def random_embeddings(n, dim=512, seed=0):
+    """Unit-length random embeddings, like InceptionResnetV1 outputs"""
+    generator = torch.Generator().manual_seed(seed)
+    return torch.nn.functional.normalize(torch.randn(n, dim, generator=generator), dim=1)
+
+
+def synthetic_frames(count, width, height, faces, face_images, seed=0):
+    """Noise frames with `faces` photos pasted at random places; returns frames and the pasted boxes"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    frames, boxes = [], []
+    for i in range(count):
+        frame = cv2.GaussianBlur(np.roll(background, 7 * i, axis=1), (9, 9), 0)
+        frame_boxes = []
+        for _ in range(faces):
+            size = int(rng.integers(height // 6, height // 3))
+            x, y = int(rng.integers(0, width - size)), int(rng.integers(0, height - size))
+            if face_images:
+                face = face_images[int(rng.integers(len(face_images)))]
+                frame[y:y + size, x:x + size] = cv2.resize(face, (size, size), interpolation=cv2.INTER_AREA)
+            frame_boxes.append([x, y, x + size, y + size])
+        frames.append(frame)
+        boxes.append(np.array(frame_boxes, dtype=np.float32).reshape(-1, 4))
+    return frames, boxes
+
+
+def write_video(path, frames, fps=25):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (frames[0].shape[1], frames[0].shape[0]))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+
+def measure(func, items, iterations, warmup=2):
+    """Latency percentiles, throughput and traced peak memory of func over items (cycled)"""
+    for i in range(warmup):
+        func(items[i % len(items)])
+
+    latencies = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(items[i % len(items)])
+        latencies[i] = time.perf_counter() - start
+
+    # Separate short pass, tracemalloc slows allocations down (torch tensors are not traced)
+    tracemalloc.start()
+    for i in range(min(iterations, 3)):
+        func(items[i % len(items)])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies *= 1000
+    return {
+        'iterations': iterations,
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'per_sec': round(1000 / float(latencies.mean()), 2),
+        'peak_traced_mb': round(peak / 2 ** 20, 2),
+    }
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+    }
+
+
+def bench_gallery(results, sizes, faces_counts, index_config, metric, iterations):
+    """Gallery matching against galleries of each size, for each number of faces per frame"""
+    for size in sizes:
+        gallery = Gallery(list(range(1, size + 1)), random_embeddings(size), metric, get_index(index_config))
+        for faces in faces_counts:
+            queries = [random_embeddings(faces, seed=seed) for seed in range(1, 9)]
+            results[f'match[gallery={size},faces={faces}]'] = measure(gallery.match, queries, iterations)
+            print(f"match gallery={size} faces={faces}: {results[f'match[gallery={size},faces={faces}]']['p50_ms']} ms")
+
+
+def bench_frames(results, config, args, face_images, workdir):
+    """Capture, recognition, zone check, overlay and feed encoding on replayed frames"""
+    stop_event = threading.Event()
+    size = args.gallery_sizes[0]
+    EmbeddingStore(os.path.join(workdir, 'gallery')).write(list(range(1, size + 1)), random_embeddings(size).numpy())
+    users = {i: f'User {i}' for i in range(1, size + 1)}
+    users[0] = config['no_name_user']
+    config['embedding_folder'] = os.path.join(workdir, 'gallery')
+    config['tracker'] = {'enabled': False}  # every frame pays full recognition, so runs are comparable
+    config['facenet']['pretrained'] = None if args.pretrained == 'none' else args.pretrained
+
+    for faces in args.faces:
+        if args.video:
+            video, boxes = args.video, None
+        else:
+            frames, boxes = synthetic_frames(args.frames, args.width, args.height, faces, face_images)
+            video = os.path.join(workdir, f'frames_{faces}.avi')
+            # Long enough for the capture measurement, which reads the file through once
+            write_video(video, [frames[i % len(frames)] for i in range(max(args.frames, args.iterations + 8))])
+        frame_count = int(cv2.VideoCapture(video).get(cv2.CAP_PROP_FRAME_COUNT))
+
+        config['camera'] = {**config['camera'], 'id': video, 'reduce_frame': 1}
+        camera = Camera(config, stop_event)
+        label = 'video' if args.video else f'faces={faces}'
+        # Every read consumes a frame: the constructor, one warmup and the memory pass take five
+        reads = max(min(args.iterations, frame_count - 5), 1)
+        results[f'capture[{label}]'] = measure(lambda _: camera.video_capture(), [None], reads, warmup=1)
+        camera.release()
+
+        camera = Camera(config, stop_event)
+        frames = [camera.frame.copy()] + [camera.video_capture()[1].copy()
+                                          for _ in range(min(args.frames, frame_count) - 1)]
+        engine = get_engine(config, users, camera)
+        roi = camera.detection_roi()
+        detections = [engine.detect_faces(frame, roi) for frame in frames]
+        results[f'detect[{label}]'] = measure(lambda frame: engine.detect_faces(frame, roi), frames, args.iterations)
+        results[f'detect[{label}]']['faces_found'] = int(sum(len(ids) for ids, _ in detections))
+
+        # Zone check and overlay on the pasted boxes, so their cost scales with faces even if none were found
+        if boxes is not None:
+            detections = [([1 + i % size for i in range(len(b))], b) for b in boxes]
+        results[f'check_areas[{label}]'] = measure(lambda d: camera.check_areas(d[1], d[0]), detections, args.iterations)
+        items = list(zip(frames, detections))
+        results[f'render[{label}]'] = measure(lambda item: camera.show(item[1][1], item[1][0], users, item[0]),
+                                              items, args.iterations)
+
+        broadcaster = FrameBroadcaster({**config['camera'].get('feed', {}), 'max_fps': 0}, stop_event)
+        broadcaster.clients = 1  # as if one viewer were connected
+        results[f'encode[{label}]'] = measure(broadcaster.publish, frames, args.iterations)
+        camera.release()
+        for name in (f'capture[{label}]', f'detect[{label}]', f'render[{label}]', f'encode[{label}]'):
+            print(f"{name}: {results[name]['p50_ms']} ms")
+        if args.video:
+            break
+
+
+def compare(results, baseline, tolerance):
+    """Print p50 change per stage against a baseline run; returns the stages slower than tolerance"""
+    regressions = []
+    for name, stage in results['stages'].items():
+        old = baseline['stages'].get(name)
+        if not old or not old['p50_ms']:
+            continue
+        change = stage['p50_ms'] / old['p50_ms'] - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:45s} {old['p50_ms']:10.3f} -> {stage['p50_ms']:10.3f} ms ({change:+.1%}){flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-stage latency, throughput and memory benchmark (offline, CPU)")
+    parser.add_argument('--config', default='configs/config.yaml')
+    parser.add_argument('--gallery-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--faces', type=int, nargs='+', default=[0, 1, 4], help="Faces per frame")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--frames', type=int, default=20, help="Distinct frames generated or read from --video")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--video', help="Replay this recorded video instead of generated frames")
+    parser.add_argument('--faces-folder', help="Photos pasted into generated frames (default: images_folder)")
+    parser.add_argument('--pretrained', default='vggface2', help="InceptionResnetV1 weights, 'none' for random")
+    parser.add_argument('--skip-frames', action='store_true', help="Only benchmark gallery matching")
+    parser.add_argument('--output', help="Write results as JSON")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed p50 slowdown against the baseline")
+    args = parser.parse_args()
+
+    torch.set_grad_enabled(False)
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    results = {'machine': machine_info(), 'args': vars(args), 'stages': {}}
+
+    bench_gallery(results['stages'], args.gallery_sizes, [f for f in args.faces if f] or [1],
+                  config['facenet'].get('index'), config['facenet'].get('metric', 'l2'), args.iterations)
+    if not args.skip_frames:
+        folder = args.faces_folder or config.get('images_folder', '')
+        face_images = [image for image in (cv2.imread(path) for path in sorted(glob.glob(folder + '/*'))[:50])
+                       if image is not None]
+        if not face_images and not args.video:
+            print(f"No photos in '{folder}': generated frames contain no faces, only their boxes are drawn")
+        with tempfile.TemporaryDirectory() as workdir:
+            bench_frames(results['stages'], copy.deepcopy(config), args, face_images, workdir)
+    results['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+import cv2
+
+from src import metrics
+
+BOUNDARY = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+ENCODE_SECONDS = metrics.histogram('facegate_jpeg_encode_seconds', "Video feed JPEG encoding time", ['stream'])
+
+
+class FrameBroadcaster:
+    """Encodes each rendered frame to JPEG once and fans the same bytes out to every video feed client"""
+
+    def __init__(self, feed_config, stop_event, name='default'):
+        self.name = name
+        self.stop_event = stop_event
+        self.lock = threading.Lock()
+        self.part = None  # multipart chunk of the latest encoded frame
+        self.sequence = 0
+        self.clients = 0
+        self.last_encode = 0.0
+        self.frames_encoded = 0
+        self.frames_skipped = 0
+        self.apply_config(feed_config)
+
+    def apply_config(self, feed_config):
+        self.quality = feed_config.get('quality', 80)  # JPEG quality, 0-100
+        self.width = feed_config.get('width', 0)  # downscale wider frames to this width, 0 = keep
+        self.max_fps = feed_config.get('max_fps', 15)  # 0 = no limit
+        self.interval = 1 / self.max_fps if self.max_fps else 0.0
+
+    def wants_frame(self):
+        """True if a client is connected and max_fps allows a new frame, so rendering is worth it"""
+        wanted = self.clients > 0 and time.monotonic() - self.last_encode >= self.interval
+        if not wanted:
+            self.frames_skipped += 1
+        return wanted
+
+    def publish(self, frame):
+        """Encode a rendered frame for the clients; returns False if skipped (no clients or above max_fps)"""
+        return self.wants_frame() and self.encode(frame)
+
+    def encode(self, frame):
+        """Encode a frame for the clients without checking wants_frame, for callers that checked already"""
+        self.last_encode = time.monotonic()
+        start = time.perf_counter()
+
+        if self.width and frame.shape[1] > self.width:
+            height = max(int(frame.shape[0] * self.width / frame.shape[1]), 1)
+            frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        ENCODE_SECONDS.observe(time.perf_counter() - start, stream=self.name)
+        with self.lock:
+            self.part = BOUNDARY + jpeg.tobytes() + b'\r\n'
+            self.sequence += 1
+        self.frames_encoded += 1
+        return True
+
+    async def stream(self):
+        """Multipart JPEG chunks for one client, each new frame sent once"""
+        with self.lock:
+            self.clients += 1
+        try:
+            seen = 0
+            while not self.stop_event.is_set():
+                with self.lock:
+                    sequence, part = self.sequence, self.part
+                if sequence != seen:
+                    seen = sequence
+                    yield part
+                await asyncio.sleep(self.interval / 2 if self.interval else 0.01)
+        finally:
+            with self.lock:
+                self.clients -= 1
+
+    def stats(self):
+        return {'clients': self.clients, 'frames_encoded': self.frames_encoded, 'frames_skipped': self.frames_skipped}
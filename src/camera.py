@@ -1,10 +1,9 @@
 import logging
-import time
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
 from tenacity import retry, stop_after_attempt, wait_fixed
 
+from src.overlay import OverlayRenderer
 from src.utils import DoorState
 
 STOP_AFTER_ATTEMPT = 200
@@ -16,12 +15,13 @@ logger = logging.getLogger(__name__)
 class Camera:
     """Camera handler for video capture and frame processing"""
     
-    def __init__(self, config, stop_event):
+    def __init__(self, config, stop_event, capture=None):
         self.config = config
         self.camera_config = config["camera"]
         self.camera_id = self.camera_config["id"]
         self.reduce_frame = self.camera_config["reduce_frame"]
-        self.cap = cv2.VideoCapture(self.camera_id)
+        # A capture object passed in (any cv2.VideoCapture-like reader) is read by its owner
+        self.cap = cv2.VideoCapture(self.camera_id) if capture is None else capture
         self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Minimal buffer for low latency
         self.stop_event = stop_event
 
@@ -29,8 +29,18 @@ class Camera:
         self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) / self.reduce_frame)
 
         self.frame = None
-        self.show_frame = None
-        self.video_capture()
+        self.overlay = OverlayRenderer()
+        if capture is None:
+            self.video_capture()
+        self.exit_area, self.entrance_area = self.get_frame_areas()
+
+    def apply_config(self, config):
+        """Apply zone and frame size settings in place, without reopening the device"""
+        self.config = config
+        self.camera_config = config["camera"]
+        self.reduce_frame = self.camera_config["reduce_frame"]
+        self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) / self.reduce_frame)
+        self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) / self.reduce_frame)
         self.exit_area, self.entrance_area = self.get_frame_areas()
 
     @retry(wait=wait_fixed(WAIT), stop=stop_after_attempt(STOP_AFTER_ATTEMPT))  # retry if attempt failed
@@ -42,19 +52,6 @@ class Camera:
             raise IOError("Camera is not available")
         return ret, self.frame
 
-    def generate(self):
-        try:
-            while not self.stop_event.is_set():
-                if self.show_frame is not None:
-                    _, jpeg = cv2.imencode('.jpg', self.show_frame)
-                else:
-                    _, jpeg = cv2.imencode('.jpg', np.ndarray((3, 3, 3), dtype=np.uint8))
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
-                time.sleep(0.05)
-        except GeneratorExit:
-            pass
-
     def get_frame_areas(self):
         """Convert relative areas to absolute pixel coordinates"""
         area_1 = self.config['turnstiles']['area_1']  # Exit area [x, y, w, h]
@@ -69,6 +66,26 @@ class Camera:
 
         return exit_area, entrance_area
 
+    def detection_roi(self):
+        """Padded union of the turnstile zones as [x1, y1, x2, y2], or None when ROI detection is off"""
+        if not self.camera_config.get('roi'):
+            return None
+        padding = self.camera_config.get('roi_padding', 0.1)
+        pad_x, pad_y = int(padding * self.frame_width), int(padding * self.frame_height)
+        areas = np.array([self.exit_area, self.entrance_area])
+        return [max(int(areas[:, 0].min()) - pad_x, 0), max(int(areas[:, 1].min()) - pad_y, 0),
+                min(int(areas[:, 2].max()) + pad_x, self.frame_width),
+                min(int(areas[:, 3].max()) + pad_y, self.frame_height)]
+
+    def min_face_size(self):
+        """Smallest face worth detecting: a fraction of the lower zone's height, in pixels of the reduced frame"""
+        zone_height = min(self.exit_area[3] - self.exit_area[1], self.entrance_area[3] - self.entrance_area[1])
+        return int(self.camera_config.get('min_face_fraction', 0.1) * zone_height)
+
+    def overview(self):
+        """(full_frame_interval, coarse_scale) of the full-frame scan that finds faces outside the ROI"""
+        return self.camera_config.get('full_frame_interval', 0), self.camera_config.get('coarse_scale', 0.5)
+
     def face_in_area(self, face_location, area):
         """Check if face is within specified area (center or full containment)"""
         if self.camera_config['frame_mode'] == 'center':
@@ -92,108 +109,11 @@ class Camera:
                 return i, DoorState.ENTRANCE
         return None, DoorState.CLOSED
 
-    def show(self, face_locations, recognized_ids, users):
-        """Render frame with bounding boxes and labels"""
-        img = Image.fromarray(self.frame[:, :, ::-1].copy()).convert("RGB")
-
-        # Draw area boundaries
-        try:
-            img = self.draw_box(img, self.exit_area, label='Exit', color='red')
-            img = self.draw_box(img, self.entrance_area, label='Entrance', color='green')
-
-            # Draw face boxes with names
-            for user_id, box in zip(recognized_ids, face_locations):
-                if user_id not in users:
-                    user_id = 0
-                user_name = users[user_id]
-                img = self.draw_box(img, box, label=user_name)
-        except Exception as exc:
-            logger.debug("Skipping frame overlay due to error: %s", exc)
-
-        self.show_frame = np.asarray(img)[:, :, ::-1]
-
-    def draw_box(
-            self,
-            image: np.ndarray,
-            box,
-            label=None,
-            color=(66, 133, 244),  # nice blue
-            outline=3,  # outline width
-            radius=12,  # corner radius
-            label_text_color=(255, 255, 255),
-            font_path=None,  # e.g. "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-            font_size=16
-    ):
-        """
-        Draws pretty rounded boxes + label pills on top of image (OpenCV-style).
-        """
-
-        # overlay for semi-transparency
-        draw = ImageDraw.Draw(image, "RGB")
-
-        # optional font
-        try:
-            font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default()
-        except Exception:
-            font = ImageFont.load_default()
-
-        # Normalize and validate incoming coordinates
-        coords = np.asarray(box, dtype=float)
-        if coords.shape[0] != 4 or not np.all(np.isfinite(coords)):
-            return image
-
-        x1, y1, x2, y2 = coords
-
-        # Ensure coordinates are valid before clipping
-        if x1 > x2:
-            x1, x2 = x2, x1
-        if y1 > y2:
-            y1, y2 = y2, y1
-
-        # Clip coordinates to frame boundaries
-        x1 = float(np.clip(x1, 0, self.frame_width))
-        x2 = float(np.clip(x2, 0, self.frame_width))
-        y1 = float(np.clip(y1, 0, self.frame_height))
-        y2 = float(np.clip(y2, 0, self.frame_height))
-
-        # Check if rectangle is still valid after clipping
-        if x1 >= x2 or y1 >= y2:
-            return image
-        # Round to int for PIL drawing primitives
-        x1, y1, x2, y2 = map(int, (round(x1), round(y1), round(x2), round(y2)))
-
-        # --- filled rounded rect ---
-        draw.rounded_rectangle(
-            [x1, y1, x2, y2],
-            radius=radius,
-            fill=None,
-            outline=color,
-            width=outline
-        )
-
-        # --- label pill (optional) ---
-        if label is not None:
-            # text size
-            tw, th = draw.textbbox((0, 0), label, font=font)[2:]
-            pad_x, pad_y = 8, 4
-            pill_h = th + 2 * pad_y
-            pill_w = tw + 2 * pad_x
-            pill_x1, pill_y1 = x1, max(y1 - pill_h - 6, 2)
-            pill_x2, pill_y2 = pill_x1 + pill_w, pill_y1 + pill_h
-
-            # pill background
-            draw.rounded_rectangle(
-                [pill_x1, pill_y1, pill_x2, pill_y2],
-                radius=int(pill_h / 2),
-                fill=None
-            )
-            # text
-            draw.text(
-                (pill_x1 + pad_x, pill_y1 + pad_y),
-                label, font=font, fill=label_text_color
-            )
-
-        return image
+    def show(self, face_locations, recognized_ids, users, frame=None):
+        """Return the frame (the last captured one by default) rendered with bounding boxes and labels"""
+        frame = self.frame if frame is None else frame
+        labels = [users.get(user_id, users.get(0)) for user_id in recognized_ids]
+        return self.overlay.render(frame, self.exit_area, self.entrance_area, face_locations, labels)
 
     def release(self):
         if self.cap:
@@ -0,0 +1,76 @@
+from typing import Set
+
+# Config keys (dotted paths, most specific first) and the component a change to them affects
+COMPONENTS = [
+    ('turnstiles.area_1', 'zones'),
+    ('turnstiles.area_2', 'zones'),
+    ('camera.frame_mode', 'zones'),
+    ('camera.reduce_frame', 'zones'),
+    ('camera.roi', 'zones'),
+    ('camera.roi_padding', 'zones'),
+    ('camera.full_frame_interval', 'zones'),
+    ('camera.coarse_scale', 'zones'),
+    ('camera.min_face_fraction', 'zones'),
+    ('camera.id', 'camera'),
+    ('camera.feed', 'feed'),
+    ('facenet.threshold', 'thresholds'),
+    ('turnstiles.min_time_diff', 'thresholds'),
+    ('test_mode', 'thresholds'),
+    ('facenet.metric', 'gallery'),
+    ('facenet.index', 'gallery'),
+    ('embedding_folder', 'gallery'),
+    ('source', 'users'),
+    ('excel_file', 'users'),
+    ('no_name_user', 'users'),
+    ('mode', 'model'),
+    ('facenet', 'model'),
+    ('tracker', 'model'),
+    ('worker', 'model'),
+    ('recognize', 'api'),
+    ('motion', 'motion'),
+    ('connection', 'connection'),
+    ('turnstiles.id_tur', 'connection'),
+    ('cameras', 'streams'),
+]
+
+
+def flatten(config, prefix=''):
+    """Flatten nested config sections into {'section.key': value}"""
+    flat = {}
+    for key, value in (config or {}).items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + '.'))
+        else:
+            flat[path] = value
+    return flat
+
+
+def component_of(path):
+    """Component affected by a change to the given dotted config path"""
+    for key, component in COMPONENTS:
+        if path == key or path.startswith(key + '.'):
+            return component
+    return 'other'
+
+
+def classify_changes(old_config, new_config) -> Set[str]:
+    """Set of components (as named in COMPONENTS, or 'other') whose settings differ"""
+    old, new = flatten(old_config), flatten(new_config)
+    return {component_of(path) for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
+
+def stream_configs(config):
+    """Per-stream configs {name: config}: each `cameras` entry layered over the shared camera and turnstiles sections"""
+    if not config.get('cameras'):
+        return {'default': config}
+
+    streams = {}
+    for i, entry in enumerate(config['cameras']):
+        name = str(entry.get('name', f'camera{i}'))
+        streams[name] = {
+            **config,
+            'camera': {**config.get('camera', {}), **entry.get('camera', {})},
+            'turnstiles': {**config.get('turnstiles', {}), **entry.get('turnstiles', {})},
+        }
+    return streams
@@ -0,0 +1,107 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from src import metrics
+
+DOOR_SECONDS = metrics.histogram('facegate_door_call_seconds', "Door command time including retries",
+                                 ['stream', 'result'])
+DOOR_DROPPED = metrics.counter('facegate_door_commands_dropped_total',
+                               "Door commands dropped because the queue was full or they outlived connection.max_age",
+                               ['stream', 'reason'])
+
+logger = logging.getLogger(__name__)
+
+
+class DoorDispatcher:
+    """Background worker sending door commands, so the pipeline never waits on the controller"""
+
+    def __init__(self, name, stop_event, max_pending=16):
+        self.name = name
+        self.stop_event = stop_event
+        self.stopped = False
+        self.commands = queue.Queue(max_pending)
+        self.latencies = deque(maxlen=500)  # seconds per sent command, most recent
+        self.submitted = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.expired = 0
+        self.thread = threading.Thread(target=self.run, name=f'doors-{name}', daemon=True)
+        self.thread.start()
+
+    def submit(self, connection, user_id, direction, user_name):
+        """Queue a door command; returns False if it repeats the last one within min_time_diff or the queue is full"""
+        if connection.is_repeat(user_id):
+            self.deduplicated += 1
+            return False
+        try:
+            self.commands.put_nowait((connection, user_id, direction, user_name, time.perf_counter()))
+        except queue.Full:
+            self.dropped += 1
+            DOOR_DROPPED.inc(stream=self.name, reason='full')
+            logger.warning("Door queue of %s is full, dropping command for %s", self.name, user_name)
+            return False
+        # Only a queued command starts the min_time_diff window, so a dropped one is retried on the next frame
+        connection.record_open(user_id, direction)
+        self.submitted += 1
+        return True
+
+    def run(self):
+        while not self.stop_event.is_set() and not self.stopped:
+            try:
+                connection, user_id, direction, user_name, queued = self.commands.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            deadline = queued + connection.max_age  # a late door opening lets in whoever stands there by then
+            if start > deadline:
+                self.expire(user_name, start - queued)
+                continue
+            try:
+                success = connection.notify_pass(user_id, direction, deadline)
+            except Exception as exc:
+                logger.exception("Door command for %s failed: %s", user_name, exc)
+                success = False
+            done = time.perf_counter()
+            self.latencies.append(done - start)
+            expired = not success and done > deadline
+            DOOR_SECONDS.observe(self.latencies[-1], stream=self.name,
+                                 result='sent' if success else 'expired' if expired else 'failed')
+            if success:
+                self.sent += 1
+            elif expired:
+                self.expire(user_name, done - queued)
+            else:
+                self.failed += 1
+                logger.error("Door command for %s on %s failed after retries (queued %.2fs before)",
+                             user_name, self.name, start - queued)
+
+    def expire(self, user_name, age):
+        self.expired += 1
+        DOOR_DROPPED.inc(stream=self.name, reason='expired')
+        logger.warning("Door command for %s on %s dropped after %.2fs, older than connection.max_age",
+                       user_name, self.name, age)
+
+    def close(self):
+        self.stopped = True
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'submitted': self.submitted,
+            'deduplicated': self.deduplicated,
+            'dropped': self.dropped,
+            'sent': self.sent,
+            'failed': self.failed,
+            'expired': self.expired,
+            'pending': self.commands.qsize(),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else 0.0,
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2) if len(latencies) else 0.0,
+            'max_ms': round(float(latencies.max()), 2) if len(latencies) else 0.0,
+        }
@@ -1,4 +1,17 @@
-from .base import FaceEngine
-from .facenet import FacenetEngine
-from .face_recognition import FaceRecognitionEngine
-from .factory import get_engine
+import importlib
+
+# Engines are imported on first use, torch and facenet_pytorch take seconds to import
+_EXPORTS = {
+    'FaceEngine': '.base',
+    'FacenetEngine': '.facenet',
+    'FaceRecognitionEngine': '.face_recognition',
+    'RemoteEngine': '.remote',
+    'engine_class': '.factory',
+    'get_engine': '.factory',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
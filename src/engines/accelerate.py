@@ -0,0 +1,203 @@
+import argparse
+import glob
+import json
+import logging
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# fp32 eager PyTorch, as before these settings existed (inference_mode only affects the engine)
+DEFAULTS = {'threads': 0, 'quantize': False, 'jit': 'none', 'channels_last': False, 'inference_mode': True}
+
+
+def acceleration_settings(config):
+    """facenet.acceleration from config, completed with the defaults"""
+    return {**DEFAULTS, **(config.get('facenet', {}).get('acceleration') or {})}
+
+
+def optimize(module, settings, device, examples):
+    """Apply channels-last, dynamic int8 quantization of Linear layers and TorchScript to a model in eval mode.
+
+    `examples` are inputs used for tracing. A step that fails is logged and skipped, leaving the
+    model as it was before that step.
+    """
+    if settings['channels_last']:
+        module = module.to(memory_format=torch.channels_last)
+        examples = [example.contiguous(memory_format=torch.channels_last) for example in examples]
+    if settings['quantize']:
+        if device.type == 'cpu':
+            module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            logger.warning("Dynamic quantization runs on the CPU only, skipped on %s", device)
+    if settings['jit'] in ('trace', 'script'):
+        try:
+            with torch.no_grad():
+                if settings['jit'] == 'trace':
+                    scripted = torch.jit.trace(module, examples[0], check_inputs=[(example,) for example in examples])
+                else:
+                    scripted = torch.jit.script(module)
+                module = torch.jit.optimize_for_inference(torch.jit.freeze(scripted.eval()))
+        except Exception as exc:
+            logger.warning("TorchScript (%s) failed for %s, keeping eager mode: %s",
+                           settings['jit'], type(module).__name__, exc)
+    elif settings['jit'] != 'none':
+        raise ValueError(f"Unknown jit mode: {settings['jit']}")
+    return module
+
+
+def accelerate(resnet, mtcnn, settings, device):
+    """Return (resnet, mtcnn) with the CPU optimizations in settings applied"""
+    if settings['threads']:
+        torch.set_num_threads(settings['threads'])
+    if not (settings['quantize'] or settings['channels_last'] or settings['jit'] != 'none'):
+        return resnet, mtcnn
+
+    resnet = optimize(resnet, settings, device, [torch.zeros(n, 3, 160, 160, device=device) for n in (2, 5)])
+    # facenet_pytorch reads the dtype from next(pnet.parameters()), which a frozen TorchScript module no longer has:
+    # the MTCNN stages stay eager and only get channels-last and quantization
+    stage_settings = {**settings, 'jit': 'none'}
+    mtcnn.pnet = optimize(mtcnn.pnet, stage_settings, device, [])
+    mtcnn.rnet = optimize(mtcnn.rnet, stage_settings, device, [])
+    mtcnn.onet = optimize(mtcnn.onet, stage_settings, device, [])
+    return resnet, mtcnn
+
+
+def median_time(func, repeats):
+    func()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def sample_inputs(folder, samples, mtcnn, seed=0):
+    """Face crops and RGB frames from the photos in folder, topped up with random ones; returns (faces, frames, real)"""
+    from src.engines.crop import FaceCropper
+
+    cropper = FaceCropper(mtcnn.image_size, mtcnn.margin, mtcnn.post_process)
+    faces, frames = [], []
+    for path in sorted(glob.glob(folder + '/*'))[:4 * samples]:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        frames.append(image)
+        with torch.no_grad():
+            boxes, _ = mtcnn.detect(image)
+        if boxes is not None and len(boxes) and cropper.fits(boxes[0], image.shape[1], image.shape[0]):
+            faces.append(cropper.crop(image, boxes[:1])[0].clone())
+        if len(faces) == samples:
+            break
+
+    real = len(faces)
+    generator = torch.Generator().manual_seed(seed)
+    while len(faces) < samples:
+        faces.append(torch.rand(3, 160, 160, generator=generator) * 2 - 1)
+    rng = np.random.default_rng(seed)
+    while len(frames) < 4:
+        frames.append(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8))
+    return torch.stack(faces), frames[:8], real
+
+
+def verify(config, settings, folder, samples=32, repeats=10, noise=0.5):
+    """Speedup and embedding drift of accelerated models against the fp32 baseline; returns a report"""
+    from src.engines.gallery import Gallery
+    from src.engines.models import get_models
+    from src.engines.store import EmbeddingStore
+
+    device = torch.device('cpu')
+    pretrained = config['facenet'].get('pretrained', 'vggface2')
+    weights_dir = config['facenet'].get('weights_dir')
+    threshold = config['facenet']['threshold']
+    base_resnet, base_mtcnn = get_models(device, pretrained, weights_dir=weights_dir)
+    faces, frames, real = sample_inputs(folder, samples, base_mtcnn)
+
+    def timings(resnet, mtcnn):
+        with torch.inference_mode():
+            return {
+                'resnet_batch1_ms': 1000 * median_time(lambda: resnet(faces[:1]), repeats),
+                'resnet_batch8_ms': 1000 * median_time(lambda: resnet(faces[:8]), repeats),
+                'mtcnn_ms': 1000 * median_time(lambda: [mtcnn.detect(frame) for frame in frames], repeats) / len(frames),
+            }
+
+    baseline = timings(base_resnet, base_mtcnn)
+    with torch.inference_mode():
+        base_embeddings = base_resnet(faces)
+        base_boxes = [base_mtcnn.detect(frame)[0] for frame in frames]
+
+    resnet, mtcnn = get_models(device, pretrained, settings, weights_dir)
+    accelerated = timings(resnet, mtcnn)
+    with torch.inference_mode():
+        embeddings = resnet(faces)
+        boxes = [mtcnn.detect(frame)[0] for frame in frames]
+
+    # Gallery: the configured store, or enrolled-like noisy copies of the sample faces
+    store = EmbeddingStore(config['embedding_folder'])
+    if store.exists():
+        ids, matrix = store.read()
+        gallery = Gallery(ids, matrix, config['facenet'].get('metric', 'l2'))
+    else:
+        generator = torch.Generator().manual_seed(1)
+        enrolled = base_embeddings + noise * torch.randn(base_embeddings.shape, generator=generator) / 512 ** 0.5
+        gallery = Gallery(list(range(1, samples + 1)), torch.nn.functional.normalize(enrolled, dim=1),
+                          config['facenet'].get('metric', 'l2'))
+    base_match, match = gallery.match(base_embeddings.clone()), gallery.match(embeddings.clone())
+    decisions = [(user_id if distance < threshold else 0) for user_id, distance in zip(base_match.ids, base_match.distances)]
+    new_decisions = [(user_id if distance < threshold else 0) for user_id, distance in zip(match.ids, match.distances)]
+
+    drift = torch.linalg.norm(embeddings - base_embeddings, dim=1).numpy()
+    same_boxes = sum((a is None and b is None) or (a is not None and b is not None and len(a) == len(b)
+                                                   and np.abs(a - b).max() < 2) for a, b in zip(base_boxes, boxes))
+    return {
+        'settings': settings,
+        'threads': torch.get_num_threads(),
+        'samples': samples,
+        'real_faces': real,
+        'baseline': {name: round(value, 3) for name, value in baseline.items()},
+        'accelerated': {name: round(value, 3) for name, value in accelerated.items()},
+        'speedup': {name: round(baseline[name] / accelerated[name], 2) for name in baseline},
+        'embedding_drift_mean': round(float(drift.mean()), 5),
+        'embedding_drift_max': round(float(drift.max()), 5),
+        'drift_to_threshold': round(float(drift.max()) / threshold, 5),
+        'match_distance_change_max': round(float(np.abs(np.asarray(match.distances) -
+                                                        np.asarray(base_match.distances)).max()), 5),
+        'decision_agreement': round(float(np.mean([a == b for a, b in zip(decisions, new_decisions)])), 4),
+        'detection_agreement': round(same_boxes / len(frames), 4),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check speedup and embedding drift of facenet.acceleration settings")
+    parser.add_argument('--config', default='configs/config_current.yaml')
+    parser.add_argument('--images', help="Sample photos (default: images_folder)")
+    parser.add_argument('--samples', type=int, default=32)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--threads', type=int, help="Override facenet.acceleration.threads")
+    parser.add_argument('--quantize', action=argparse.BooleanOptionalAction, default=None)
+    parser.add_argument('--jit', choices=['none', 'trace', 'script'])
+    parser.add_argument('--channels-last', action=argparse.BooleanOptionalAction, default=None)
+    parser.add_argument('--max-drift', type=float, default=0.05,
+                        help="Largest allowed embedding drift as a fraction of facenet.threshold")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    settings = acceleration_settings(config)
+    for name in ('threads', 'quantize', 'jit', 'channels_last'):
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+
+    report = verify(config, settings, args.images or config['images_folder'], args.samples, args.repeats)
+    print(json.dumps(report, indent=1))
+    if report['drift_to_threshold'] > args.max_drift or report['decision_agreement'] < 1.0:
+        print("Accelerated models change recognition decisions, keep facenet.threshold under review")
+        sys.exit(1)
@@ -1,4 +1,16 @@
-import pickle
+import contextlib
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+
+from src.engines.gallery import Gallery
+from src.engines.index import get_index
+from src.engines.store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
 
 
 class FaceEngine:
@@ -6,7 +18,17 @@ class FaceEngine:
     
     def __init__(self, config, users, camera):
         self.config = config
-        self.embeddings = self.load_embeddings(users)
+        # Matrix form of the embeddings, built once and used for batched matching
+        self.gallery = self.load_embeddings(users)
+
+    @classmethod
+    def preload(cls, config):
+        """Load models ahead of construction, e.g. while the cameras are being opened"""
+        pass
+
+    def warm_up(self, frame_sizes):
+        """Run inference once on dummy frames of the given (width, height) sizes before live frames arrive"""
+        pass
 
     def encode_image(self, image):
         """Encode image to face embedding"""
@@ -16,21 +38,125 @@ class FaceEngine:
         """Generate embeddings for all images in folder"""
         pass
 
-    def detect_faces(self, frame):
-        """Detect faces in frame and return recognized IDs and locations"""
+    def detect_faces(self, frame, roi=None, stream='default'):
+        """Detect faces in frame (only inside roi [x1, y1, x2, y2], if given) and return recognized IDs and locations"""
+        pass
+
+    def detect_faces_batch(self, frames, rois=None, streams=None, min_faces=None, overviews=None):
+        """Detect faces on frames from several camera streams, returning (IDs, locations) per frame"""
+        rois = rois or [None] * len(frames)
+        streams = streams or ['default'] * len(frames)
+        return [self.detect_faces(frame, roi, stream) for frame, roi, stream in zip(frames, rois, streams)]
+
+    def recognize_images(self, images):
+        """Detect and recognize faces on independent RGB images, returning (IDs, boxes, distances) per image"""
+        raise NotImplementedError(f"{type(self).__name__} does not recognize uploaded images")
+
+    def stats(self):
+        """Engine counters per camera stream"""
+        return {}
+
+    def remove_stream(self, stream):
+        """Drop per-stream state of a camera that is no longer configured"""
+        pass
+
+    def close(self):
+        """Release what the engine holds outside this process, once it has been replaced"""
         pass
 
-    def load_embeddings(self, users):
-        """Load face embeddings for all users"""
-        embeddings = {}
+    @property
+    def store(self):
+        return EmbeddingStore(self.config["embedding_folder"])
+
+    def apply_config(self, config, gallery=None):
+        """Switch to a new config in place, with a gallery prebuilt by load_embeddings if its settings changed"""
+        self.config = config
+        if gallery is not None:
+            self.gallery = gallery
+
+    def sync(self, users, lock=None):
+        """Bring the gallery in line with users and the embedding store, touching only changed identities.
+
+        The new gallery is swapped in under `lock` only if no other gallery (e.g. from a config change)
+        replaced the one it was derived from meanwhile; otherwise the changes are recomputed against that one.
+        """
+        start = time.perf_counter()
+        user_ids = {str(id): id for id in users.keys() if id != 0}
+        while True:
+            gallery = self.gallery
+            store = self.store  # of the config the gallery was loaded with
+            stored_ids, matrix = store.read() if store.exists() else ([], np.empty((0, 0)))
+            rows = {}  # user ID -> store rows, one per template
+            for i, id in enumerate(stored_ids):
+                if id in user_ids:
+                    rows.setdefault(user_ids[id], []).append(i)
+            added, removed, updated = self.changes(gallery, rows, matrix)
+            new_gallery = gallery
+            if added or removed or updated:
+                upserts = added + updated
+                upsert_rows = [i for id in upserts for i in rows[id]]
+                upsert_matrix = np.asarray(matrix[upsert_rows]) if upserts else np.empty((0, matrix.shape[1]))
+                new_gallery = gallery.updated([id for id in upserts for _ in rows[id]], upsert_matrix, removed)
+            with lock or contextlib.nullcontext():
+                if self.gallery is gallery:
+                    # Replacing the reference is atomic, so frames in flight keep matching against the old gallery
+                    self.gallery = new_gallery
+                    break
+
+        report = {
+            'added': [str(id) for id in added],
+            'removed': [str(id) for id in removed],
+            'updated': [str(id) for id in updated],
+            'gallery_size': len(self.gallery),
+            'gallery_users': len(self.gallery.user_ids),
+            'elapsed': round(time.perf_counter() - start, 4),
+        }
+        logger.info("Synced gallery: %d added, %d removed, %d updated in %.3fs",
+                    len(added), len(removed), len(updated), report['elapsed'])
+        return report
+
+    @staticmethod
+    def changes(gallery, rows, matrix):
+        """(added, removed, updated) user IDs of the store rows {user ID: rows} against a gallery"""
+        current = {}  # user ID -> gallery rows
+        for i, id in enumerate(gallery.ids):
+            current.setdefault(id, []).append(i)
+
+        added = [id for id in rows if id not in current]
+        removed = [id for id in current if id not in rows]
+        common = [id for id in rows if id in current]
+        # Users whose template count changed are updated, the others if any template differs
+        updated = [id for id in common if len(rows[id]) != len(current[id])]
+        same = [id for id in common if len(rows[id]) == len(current[id])]
+        if same:
+            stored = gallery.prepare(np.asarray(matrix[[i for id in same for i in rows[id]]]))
+            changed = ~torch.isclose(stored, gallery.matrix[[i for id in same for i in current[id]]]).all(dim=1)
+            owners = np.repeat(np.arange(len(same)), [len(rows[id]) for id in same])
+            flagged = set(owners[changed.numpy()].tolist())
+            updated += [id for position, id in enumerate(same) if position in flagged]
+        return added, removed, updated
+
+    def load_embeddings(self, users, config=None):
+        """Load face embeddings for all users from the embedding store (of the given config, if any)"""
+        config = config or self.config
+        store = EmbeddingStore(config["embedding_folder"])
+        if not store.exists() and os.path.isdir(store.folder):
+            logger.info("No embedding store in %s, migrating pickled embeddings", store.folder)
+            store.migrate()
 
-        for id in users.keys():
-            if id == 0:  # Skip unknown user placeholder
-                continue
-            path = f'{self.config["embedding_folder"]}/{id}'
+        facenet_config = config.get('facenet', {})
+        metric, index = facenet_config.get('metric', 'l2'), get_index(facenet_config.get('index'))
+        if not store.exists():
+            logger.warning("No embedding store in %s, no user can be recognized", store.folder)
+            return Gallery([], np.empty((0, 0)), metric, index)
+        stored_ids, matrix = store.read()
+        user_ids = {str(id): id for id in users.keys() if id != 0}  # Skip unknown user placeholder
 
-            with open(path, 'rb') as file:
-                embedding = pickle.load(file)
+        rows = [i for i, id in enumerate(stored_ids) if id in user_ids]
+        missing = len(user_ids) - len({stored_ids[i] for i in rows})
+        if missing:
+            logger.warning("%d users have no stored embedding", missing)
 
-            embeddings[id] = embedding
-        return embeddings
+        if len(rows) < len(stored_ids):
+            matrix = matrix[np.asarray(rows, dtype=np.intp)]  # copies only when the store holds extra users
+        return Gallery([user_ids[stored_ids[i]] for i in rows], matrix, metric, index)
@@ -0,0 +1,233 @@
+import argparse
+import json
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+import yaml
+from facenet_pytorch.models.utils.detect_face import detect_face
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {'mode': 'single', 'detector': 'yunet', 'model': None, 'face_pixels': 24, 'padding': 0.5}
+
+MTCNN_MIN_FACE = 12  # P-Net's window, MTCNN finds no smaller faces at any scale
+HAAR_SCALE_FACTOR = 1.1
+HAAR_MIN_NEIGHBORS = 3  # few neighbors: false proposals only cost a small MTCNN pass, missed faces are lost
+YUNET_SCORE_THRESHOLD = 0.5
+
+PROPOSALS = metrics.counter('facegate_cascade_proposals_total', "Face regions proposed by the cascade pre-detector")
+CASCADE_FRAMES = metrics.counter('facegate_cascade_frames_total',
+                                 "Frames by cascade outcome: refined by MTCNN, or skipped without proposals",
+                                 ['result'])
+
+
+def detection_settings(config):
+    """facenet.detection from config, completed with the defaults"""
+    return {**DEFAULTS, **(config.get('facenet', {}).get('detection') or {})}
+
+
+def mtcnn_boxes(mtcnn, image, min_face):
+    """MTCNN boxes (N, 4), largest first, with its thresholds but the given smallest face size"""
+    with torch.no_grad():
+        batch_boxes, _ = detect_face(image, max(min_face, MTCNN_MIN_FACE), mtcnn.pnet, mtcnn.rnet, mtcnn.onet,
+                                     mtcnn.thresholds, mtcnn.factor, mtcnn.device)
+    boxes = np.asarray(batch_boxes[0], dtype=np.float32).reshape(-1, 5)[:, :4]
+    return boxes[np.argsort(-(boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))]
+
+
+class HaarProposals:
+    """OpenCV Haar cascade, the frontal face model bundled with opencv-python unless another is given"""
+
+    def __init__(self, model=None):
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise RuntimeError(f"OpenCV {cv2.__version__} has no Haar cascades: use the yunet detector with a YuNet "
+                               f"model in facenet.detection.model, or install opencv-python<5")
+        model = model or cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        self.classifier = cv2.CascadeClassifier(model)
+        if self.classifier.empty():
+            raise RuntimeError(f"Cannot load Haar cascade {model}")
+        self.lock = threading.Lock()  # a CascadeClassifier is not safe to share between threads
+
+    def propose(self, image, face_pixels):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        with self.lock:
+            found = self.classifier.detectMultiScale(gray, HAAR_SCALE_FACTOR, HAAR_MIN_NEIGHBORS,
+                                                     minSize=(face_pixels, face_pixels))
+        boxes = np.asarray(found, dtype=np.float32).reshape(-1, 4)
+        boxes[:, 2:] += boxes[:, :2]
+        return boxes
+
+
+class YunetProposals:
+    """OpenCV's YuNet CNN face detector (face_detection_yunet_*.onnx from the OpenCV model zoo)"""
+
+    def __init__(self, model):
+        if not model:
+            raise RuntimeError("The yunet detector needs facenet.detection.model, a YuNet ONNX file "
+                               "(face_detection_yunet_2023mar.onnx from the OpenCV model zoo)")
+        self.detector = cv2.FaceDetectorYN.create(model, '', (320, 320), YUNET_SCORE_THRESHOLD)
+        self.lock = threading.Lock()
+
+    def propose(self, image, face_pixels):
+        with self.lock:
+            self.detector.setInputSize((image.shape[1], image.shape[0]))
+            _, found = self.detector.detect(image)
+        boxes = np.empty((0, 4), dtype=np.float32) if found is None else found[:, :4].astype(np.float32)
+        boxes[:, 2:] += boxes[:, :2]
+        return boxes[(boxes[:, 2] - boxes[:, 0]) >= face_pixels]
+
+
+DETECTORS = {'haar': HaarProposals, 'yunet': YunetProposals}
+
+
+def merge_regions(boxes, padding, width, height):
+    """Pad boxes by a fraction of their size, clip them to the image and merge overlapping ones into [x1, y1, x2, y2]"""
+    sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])[:, None] * padding
+    regions = np.concatenate([boxes[:, :2] - sizes, boxes[:, 2:] + sizes], axis=1)
+    regions = np.clip(regions, 0, [width, height, width, height]).astype(int).tolist()
+    merged = True
+    while merged and len(regions) > 1:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
+def proposal_detector(detector, model):
+    """The configured pre-detector; YuNet without a model falls back to Haar where this OpenCV still has it"""
+    if detector not in DETECTORS:
+        raise ValueError(f"Unknown cascade detector: {detector}")
+    if detector == 'yunet' and not model and hasattr(cv2, 'CascadeClassifier'):
+        logger.warning("No YuNet model in facenet.detection.model, using the bundled Haar cascade instead")
+        return HaarProposals()
+    return DETECTORS[detector](model)
+
+
+class DetectionCascade:
+    """Two-stage face detection: a cheap detector proposes regions on a downscaled frame, MTCNN refines only those.
+
+    The frame is downscaled so the smallest wanted face is `face_pixels` wide for the pre-detector; a
+    frame without proposals costs no MTCNN pass at all.
+    """
+
+    def __init__(self, settings, mtcnn):
+        self.mtcnn = mtcnn
+        self.face_pixels = settings['face_pixels']
+        self.padding = settings['padding']
+        self.proposals = proposal_detector(settings['detector'], settings['model'])
+
+    def detect(self, frame, min_face):
+        """Face boxes (N, 4) in frame coordinates, for faces of at least min_face pixels"""
+        min_face = max(min_face, MTCNN_MIN_FACE)
+        scale = min(self.face_pixels / min_face, 1.0)
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else frame
+        candidates = self.proposals.propose(small, self.face_pixels) / scale
+        PROPOSALS.inc(len(candidates))
+        if not len(candidates):
+            CASCADE_FRAMES.inc(result='skipped')
+            return np.empty((0, 4), dtype=np.float32)
+
+        CASCADE_FRAMES.inc(result='refined')
+        boxes = []
+        for x1, y1, x2, y2 in merge_regions(candidates, self.padding, frame.shape[1], frame.shape[0]):
+            found = mtcnn_boxes(self.mtcnn, np.ascontiguousarray(frame[y1:y2, x1:x2]), min_face)
+            boxes.append(found + np.array([x1, y1, x1, y1], dtype=np.float32))
+        return np.concatenate(boxes)
+
+
+def iou_matrix(a, b):
+    x1, y1 = np.maximum(a[:, None, 0], b[None, :, 0]), np.maximum(a[:, None, 1], b[None, :, 1])
+    x2, y2 = np.minimum(a[:, None, 2], b[None, :, 2]), np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a, area_b = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]), (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+
+def compare(config, paths, frames=200, iou=0.5):
+    """Run the single-stage and cascade paths on recorded frames; returns timing and agreement"""
+    from src.audit import PrefetchCapture, Source, find_sources
+    from src.engines.facenet import FacenetEngine
+
+    settings = detection_settings(config)
+    _, mtcnn = FacenetEngine.preload(config)
+    cascade = DetectionCascade(settings, mtcnn)
+    stop_event = threading.Event()
+    single_times, cascade_times = [], []
+    wanted = found = matched = extra = 0
+    skipped = CASCADE_FRAMES.values.get(('skipped',), 0)
+
+    for name, path, images in find_sources(paths):
+        source = Source(name, PrefetchCapture(path, images), config, stop_event)
+        min_face = source.camera.min_face_size()
+        while len(single_times) < frames:
+            item = source.next_frame()
+            if item is None:
+                break
+            frame = item[2]  # camera channel order, as the engine gets it
+            if source.roi is not None:
+                x1, y1, x2, y2 = source.roi
+                frame = np.ascontiguousarray(frame[y1:y2, x1:x2])
+
+            start = time.perf_counter()
+            single = mtcnn_boxes(mtcnn, frame, mtcnn.min_face_size)
+            single_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            boxes = cascade.detect(frame, min_face)
+            cascade_times.append(time.perf_counter() - start)
+
+            # Faces smaller than the derived minimum are left out on purpose, they are not counted as missed
+            single = single[np.maximum(single[:, 2] - single[:, 0], single[:, 3] - single[:, 1]) >= min_face]
+            wanted += len(single)
+            found += len(boxes)
+            if len(single) and len(boxes):
+                hits = iou_matrix(single, boxes) >= iou
+                matched += int(hits.any(axis=1).sum())
+                extra += int((~hits.any(axis=0)).sum())
+            else:
+                extra += len(boxes)
+        source.capture.release()
+
+    single_ms, cascade_ms = 1000 * np.asarray(single_times), 1000 * np.asarray(cascade_times)
+    return {
+        'frames': len(single_times),
+        'detector': settings['detector'],
+        'single_p50_ms': round(float(np.median(single_ms)), 2),
+        'cascade_p50_ms': round(float(np.median(cascade_ms)), 2),
+        'speedup': round(float(single_ms.sum() / cascade_ms.sum()), 2),
+        'frames_without_proposals': CASCADE_FRAMES.values.get(('skipped',), 0) - skipped,  # no MTCNN pass at all
+        'single_faces': wanted,
+        'cascade_faces': found,
+        'recall': round(matched / wanted, 4) if wanted else None,  # single-stage faces the cascade also found
+        'extra_faces': extra,  # cascade faces the single-stage path did not find
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare speed and agreement of cascade and single-stage detection")
+    parser.add_argument('paths', nargs='+', help="Video files, or folders of videos or of image sequences")
+    parser.add_argument('--config', default='configs/config_current.yaml')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--detector', choices=sorted(DETECTORS), help="Override facenet.detection.detector")
+    parser.add_argument('--model', help="Override facenet.detection.model")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    overrides = {name: getattr(args, name) for name in ('detector', 'model') if getattr(args, name)}
+    config['facenet']['detection'] = {**(config['facenet'].get('detection') or {}), **overrides}
+    print(json.dumps(compare(config, args.paths, args.frames), indent=1))
@@ -0,0 +1,180 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+import tqdm
+import yaml
+
+from src.engines.crop import FaceCropper
+from src.engines.store import EmbeddingStore
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path):
+    """SHA-1 of the file contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Enrollment:
+    """Parallel, batched and resumable enrollment of the images folder into the embedding store.
+
+    Worker threads decode photos and crop the single face in each, the main thread embeds crops
+    in batches, and results are written to the store in chunks together with a manifest of file
+    hashes, so an interrupted or repeated run only processes new or changed photos. Every photo is
+    one template of the user named before its first dot (`1042.jpg`, `1042.glasses.jpg`).
+    """
+
+    def __init__(self, config, resnet, mtcnn, device):
+        self.config = config
+        self.resnet = resnet
+        self.mtcnn = mtcnn
+        self.device = device
+        self.store = EmbeddingStore(config['embedding_folder'])
+        self.manifest_path = os.path.join(config['embedding_folder'], MANIFEST_FILE)
+
+        enrollment_config = config.get('enrollment', {})
+        self.workers = enrollment_config.get('workers', os.cpu_count() or 1)
+        self.batch_size = enrollment_config.get('batch_size', 32)
+        self.chunk_size = enrollment_config.get('chunk_size', 500)  # images per store write and manifest save
+        self.local = threading.local()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)['files']
+
+    def save_manifest(self, files):
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        with open(self.manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': files}, f, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def pending(self, paths, manifest):
+        """Photos that are new or changed since the last run, as (name, path, entry) tuples"""
+        todo = []
+        for path in paths:
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            entry = manifest.get(name)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            digest = file_digest(path)
+            if entry and entry['sha1'] == digest:
+                entry['mtime'] = stat.st_mtime  # touched but unchanged
+                continue
+            todo.append((name, path, {'sha1': digest, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                                      'id': name.split('.')[0], 'template': os.path.splitext(name)[0]}))
+        return todo
+
+    def prepare(self, path):
+        """Decode a photo and crop its face; runs in a worker thread. Returns (status, face tensor)"""
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            return 'unreadable', None
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # enrollment photos are RGB, as with PIL before
+
+        with torch.no_grad():
+            boxes, _ = self.mtcnn.detect(image, landmarks=False)
+        if boxes is None or len(boxes) == 0:
+            return 'no_face', None
+        if len(boxes) > 1:
+            return 'multiple_faces', None
+
+        if not hasattr(self.local, 'cropper'):
+            self.local.cropper = FaceCropper(self.mtcnn.image_size, self.mtcnn.margin, self.mtcnn.post_process)
+        try:
+            return 'ok', self.local.cropper.crop(image, boxes)[0].clone()
+        except ValueError:
+            return 'no_face', None
+
+    def embed(self, faces):
+        with torch.no_grad():
+            return self.resnet(torch.stack(faces).to(self.device)).cpu().numpy()
+
+    def run(self):
+        """Enroll all new or changed photos and return a summary report"""
+        start = time.perf_counter()
+        paths = sorted(p for p in glob.glob(self.config['images_folder'] + '/*') if os.path.isfile(p))
+        manifest = self.load_manifest()
+        todo = self.pending(paths, manifest)
+        failures = {}
+        enrolled = 0
+
+        with ThreadPoolExecutor(self.workers) as pool, tqdm.tqdm(total=len(todo), unit='img') as progress:
+            for offset in range(0, len(todo), self.chunk_size):
+                chunk = todo[offset:offset + self.chunk_size]
+                ids, templates, faces, rows = [], [], [], []
+                for (name, path, entry), (status, face) in zip(chunk, pool.map(self.prepare, [c[1] for c in chunk])):
+                    entry['status'] = status
+                    if face is None:
+                        failures.setdefault(status, []).append(name)
+                    else:
+                        ids.append(entry['id'])
+                        templates.append(entry['template'])
+                        faces.append(face)
+                    if len(faces) == self.batch_size:
+                        rows.append(self.embed(faces))
+                        faces = []
+                    progress.update()
+                if faces:
+                    rows.append(self.embed(faces))
+
+                # Store first, manifest second: a crash in between only means re-embedding this chunk
+                if ids:
+                    self.store.append(ids, np.concatenate(rows), templates)
+                for name, _, entry in chunk:
+                    manifest[name] = entry
+                self.save_manifest(manifest)
+                enrolled += len(ids)
+
+        if not todo:
+            self.save_manifest(manifest)
+        elapsed = time.perf_counter() - start
+        report = {
+            'images': len(paths),
+            'unchanged': len(paths) - len(todo),
+            'enrolled': enrolled,
+            'failed': {status: len(names) for status, names in failures.items()},
+            'failed_files': failures,
+            'elapsed': round(elapsed, 2),
+            'images_per_sec': round(len(todo) / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+        logger.info("Enrollment: %d enrolled, %d unchanged, failures %s, %.2f images/s",
+                    enrolled, report['unchanged'], report['failed'], report['images_per_sec'])
+        return report
+
+
+if __name__ == '__main__':
+    from src.engines.facenet import FacenetEngine, default_device
+
+    parser = argparse.ArgumentParser(description="Enroll new or changed photos from images_folder")
+    parser.add_argument('--config', default='configs/config_current.yaml')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    # Same weights and acceleration as the live engine, so the gallery matches what recognition embeds
+    resnet, mtcnn = FacenetEngine.preload(config)
+    report = Enrollment(config, resnet, mtcnn, default_device()).run()
+    for status, names in report.pop('failed_files').items():
+        print(f"{status}: {', '.join(names)}")
+    print(json.dumps(report, indent=1))
@@ -13,6 +13,6 @@ class FaceRecognitionEngine(FaceEngine):
             "Please use 'facenet' mode instead."
         )
     
-    def detect_faces(self, frame: np.ndarray):
+    def detect_faces(self, frame: np.ndarray, roi=None, stream='default'):
         """Placeholder method - not implemented"""
         raise NotImplementedError()
@@ -1,30 +1,91 @@
-import glob
-import os
-import pickle
+import time
 
+import cv2
 import numpy as np
 import torch
-import tqdm
-from PIL import Image
-from facenet_pytorch import MTCNN, InceptionResnetV1
 
+from src import metrics
+from src.engines.accelerate import acceleration_settings
 from src.engines.base import FaceEngine
+from src.engines.cascade import DetectionCascade, detection_settings
+from src.engines.crop import FaceCropper
+from src.engines.enroll import Enrollment
+from src.engines.models import get_models
+from src.tracker import FaceTracker
+
+
+DETECT_SECONDS = metrics.histogram('facegate_detection_seconds', "MTCNN face detection time per frame")
+EMBED_SECONDS = metrics.histogram('facegate_embedding_seconds', "Crop and InceptionResnetV1 time per batch")
+MATCH_SECONDS = metrics.histogram('facegate_matching_seconds', "Gallery matching time per batch")
+
+
+def frame_boxes(boxes, roi=None):
+    """MTCNN boxes of a frame or ROI crop (None if it found no face) as float32 full-frame boxes"""
+    if boxes is None or len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.float32)
+    boxes = np.asarray(boxes, dtype=np.float32)
+    return boxes if roi is None else boxes + np.array([roi[0], roi[1], roi[0], roi[1]], dtype=np.float32)
+
+
+def default_device():
+    """GPU if available, otherwise CPU"""
+    return torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+
+
+class StreamContext:
+    """Per-camera recognition state: face tracks and the full-frame overview used in ROI mode"""
+
+    def __init__(self, tracker_config, gallery):
+        tracker_config = dict(tracker_config)
+        # Optional tracker, so faces that stay in view are not re-embedded every frame
+        self.tracker = FaceTracker(**tracker_config) if tracker_config.pop('enabled', False) else None
+        self.tracked_gallery = gallery
+        self.overview_countdown = 0
+        self.outside_faces = np.empty((0, 4), dtype=np.float32)
 
 
 class FacenetEngine(FaceEngine):
     def __init__(self, config, users, camera):
         """Initialize FaceNet engine with MTCNN detector and InceptionResNetV1 embedder"""
         super().__init__(config, users, camera)
-        # Use GPU if available, otherwise CPU
-        self.device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
-        # Face embedding model
-        self.resnet = InceptionResnetV1(pretrained='vggface2').to(self.device).eval()
-        # Face detection model
-        self.mtcnn = MTCNN(
-            image_size=160, margin=0, min_face_size=20,
-            thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True, keep_all=True,
-            device=self.device
-        )
+        self.device = default_device()
+        # Embedding and detection models with the configured CPU optimizations, shared by every engine in the process
+        self.acceleration = acceleration_settings(config)
+        self.resnet, self.mtcnn = self.preload(config)
+        self.inference = torch.inference_mode if self.acceleration['inference_mode'] else torch.no_grad
+        # Optional cheap pre-detector, so MTCNN only runs around proposed faces
+        detection = detection_settings(config)
+        if detection['mode'] not in ('single', 'cascade'):
+            raise ValueError(f"Unknown detection mode: {detection['mode']}")
+        self.cascade = DetectionCascade(detection, self.mtcnn) if detection['mode'] == 'cascade' else None
+        # Builds the embedder's input batch from the frame in memory, matching mtcnn.extract
+        self.cropper = FaceCropper(image_size=self.mtcnn.image_size, margin=self.mtcnn.margin,
+                                   post_process=self.mtcnn.post_process)
+        # Separate crop buffer for uploaded images, which are recognized on another thread than the live frames
+        self.image_cropper = FaceCropper(image_size=self.mtcnn.image_size, margin=self.mtcnn.margin,
+                                         post_process=self.mtcnn.post_process)
+        # Tracks and overview state per camera stream
+        self.contexts = {}
+
+    @classmethod
+    def preload(cls, config):
+        """Load (resnet, mtcnn) for config into the process-wide model cache and return them"""
+        facenet_config = config['facenet']
+        return get_models(default_device(), facenet_config.get('pretrained', 'vggface2'), acceleration_settings(config),
+                          facenet_config.get('weights_dir'))
+
+    def warm_up(self, frame_sizes):
+        """Run detection, embedding and matching once on dummy input, so live frames skip the one-off setup costs"""
+        faces = torch.zeros(2, 3, self.mtcnn.image_size, self.mtcnn.image_size, device=self.device)
+        if self.acceleration['channels_last']:
+            faces = faces.contiguous(memory_format=torch.channels_last)
+        with self.inference():
+            for width, height in set(frame_sizes):
+                self.mtcnn.detect(np.zeros((height, width, 3), dtype=np.uint8), landmarks=False)
+                if self.cascade is not None:
+                    self.cascade.detect(np.zeros((height, width, 3), dtype=np.uint8), self.mtcnn.min_face_size)
+            embeddings = self.resnet(faces).cpu()
+        self.match_embeddings(embeddings)
 
     def encode_image(self, image):
         """Encode single image to face embedding"""
@@ -33,49 +94,180 @@ class FacenetEngine(FaceEngine):
         return [encoding]
 
     def encode_folder(self):
-        """Generate embeddings for all images in configured folder"""
-        save_to = self.config['facenet']['embedding_folder']
-        os.makedirs(save_to, exist_ok=True)
-        for file in tqdm.tqdm(glob.glob(self.config['images_folder'] + '/*')):
-            enc_file = f'{save_to}/{os.path.basename(file).split(".")[0]}'
-            if not os.path.exists(enc_file):
-                img = Image.open(file)
-                encoding = self.encode_image(img)[0]
-                with open(enc_file, 'wb') as f:
-                    pickle.dump(encoding, f)
-
-    def get_best_match_idx(self, embeddings, face_embedding):
-        """Find best matching face embedding using Euclidean distance"""
-        distances = [(face_embedding - e).norm().item() for e in embeddings]
-        best_match_index = np.argmin(distances)
-        if distances[best_match_index] >= self.config['facenet']['threshold']:
-            return None
-        return best_match_index
-
-    def detect_faces(self, frame: np.ndarray):
-        """Detect faces in frame and match with known faces"""
-        face_locations, _ = self.mtcnn.detect(frame, landmarks=False)
-        if face_locations is None or len(face_locations) == 0:
-            return [], []
-        
-        try:
-            faces = self.mtcnn.extract(frame, face_locations, save_path='faces/temp.jpg')
-        except Exception:
-            return [], []
-
-        face_locations = np.array(face_locations)
-        faces = faces.to(self.device)
-        img_embeddings = self.resnet(faces).detach().cpu()
-
-        user_ids = list(self.embeddings.keys())
-        embeddings = list(self.embeddings.values())
-        recognized_ids = []
-
-        for i, face_embedding in enumerate(img_embeddings):
-            best_match_index = self.get_best_match_idx(embeddings, face_embedding)
-            idx = 0
-            if best_match_index is not None:
-                idx = user_ids[best_match_index]
-            recognized_ids.append(idx)
-
-        return recognized_ids, face_locations
+        """Generate embeddings for new or changed images in configured folder"""
+        return Enrollment(self.config, self.resnet, self.mtcnn, self.device).run()
+
+    def match_embeddings(self, img_embeddings, gallery=None):
+        """Match a batch of face embeddings against the gallery, returning IDs (0 if unrecognized) and distances"""
+        result = (gallery or self.gallery).match(img_embeddings)
+        threshold = self.config['facenet']['threshold']
+        user_ids = [user_id if user_id is not None and distance < threshold else 0
+                    for user_id, distance in zip(result.ids, result.distances)]
+        return user_ids, result.distances
+
+    def context(self, stream):
+        if stream not in self.contexts:
+            self.contexts[stream] = StreamContext(self.config.get('tracker', {}), self.gallery)
+        return self.contexts[stream]
+
+    def remove_stream(self, stream):
+        self.contexts.pop(stream, None)
+
+    def stats(self):
+        return {stream: context.tracker.stats() for stream, context in self.contexts.items() if context.tracker}
+
+    def locate_faces(self, frame: np.ndarray, roi=None, min_face=None):
+        """Run MTCNN (or the cascade) over the region of interest (whole frame if None) and return full-frame boxes"""
+        if roi is not None:
+            x1, y1, x2, y2 = roi
+            frame = np.ascontiguousarray(frame[y1:y2, x1:x2])
+        with self.inference():
+            if self.cascade is not None and min_face is not None:
+                face_locations = self.cascade.detect(frame, min_face)
+            else:
+                face_locations, _ = self.mtcnn.detect(frame, landmarks=False)
+        return frame_boxes(face_locations, roi)
+
+    def locate_faces_batch(self, frames, rois, min_faces):
+        """Full-frame boxes per frame; same-sized frames or ROI crops share an MTCNN pass, the cascade runs per frame"""
+        if self.cascade is not None:
+            located = []
+            for frame, roi, min_face in zip(frames, rois, min_faces):
+                with DETECT_SECONDS.time():
+                    located.append(self.locate_faces(frame, roi, min_face))
+            return located
+
+        groups = {}
+        for i, (frame, roi) in enumerate(zip(frames, rois)):
+            crop = frame if roi is None else np.ascontiguousarray(frame[roi[1]:roi[3], roi[0]:roi[2]])
+            groups.setdefault(crop.shape, []).append((i, crop))
+        located = [None] * len(frames)
+        for members in groups.values():
+            start = time.perf_counter()
+            with self.inference():
+                found, _ = self.mtcnn.detect([crop for _, crop in members], landmarks=False)
+            elapsed = time.perf_counter() - start
+            for (i, _), boxes in zip(members, found):
+                DETECT_SECONDS.observe(elapsed / len(members))  # per frame, as for frames detected one by one
+                located[i] = frame_boxes(boxes, rois[i])
+        return located
+
+    def overview_faces(self, context, frame: np.ndarray, roi, overview=None):
+        """Faces outside the ROI for the overlay, from a downscaled full-frame pass every few frames.
+
+        `overview` is the camera's (full_frame_interval, coarse_scale), the shared camera section if None.
+        """
+        camera = self.config['camera']
+        interval, scale = overview or (camera.get('full_frame_interval', 0), camera.get('coarse_scale', 0.5))
+        if roi is None or not interval:
+            return np.empty((0, 4), dtype=np.float32)
+
+        if context.overview_countdown <= 0:
+            context.overview_countdown = interval
+            boxes = self.locate_faces(cv2.resize(frame, None, fx=scale, fy=scale)) / scale
+            center_x, center_y = (boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2
+            inside = (roi[0] <= center_x) & (center_x < roi[2]) & (roi[1] <= center_y) & (center_y < roi[3])
+            context.outside_faces = boxes[~inside]
+        context.overview_countdown -= 1
+        return context.outside_faces
+
+    def plan_embeddings(self, context, frame: np.ndarray, face_locations, gallery):
+        """Advance the stream's tracks and pick the faces that need a fresh embedding"""
+        to_embed, tracks = list(range(len(face_locations))), None
+        if context.tracker:
+            if gallery is not context.tracked_gallery:  # identities may have changed after a sync
+                context.tracker.invalidate()
+                context.tracked_gallery = gallery
+            tracks, to_embed = context.tracker.update(face_locations, self.config['facenet']['threshold'])
+        height, width = frame.shape[:2]
+        return tracks, [i for i in to_embed if self.cropper.fits(face_locations[i], width, height)]
+
+    def detect_faces_batch(self, frames, rois=None, streams=None, min_faces=None, overviews=None):
+        """Detect and recognize faces on frames from several cameras, embedding all faces in one forward pass"""
+        rois = rois or [None] * len(frames)
+        streams = streams or ['default'] * len(frames)
+        min_faces = min_faces or [None] * len(frames)  # smallest faces worth finding, for the cascade
+        overviews = overviews or [None] * len(frames)  # each camera's full-frame scan settings
+        gallery = self.gallery
+
+        with torch.profiler.record_function('mtcnn.detect'):
+            located = self.locate_faces_batch(frames, rois, [min_face or self.mtcnn.min_face_size
+                                                             for min_face in min_faces])
+        plans = []
+        for frame, stream, face_locations in zip(frames, streams, located):
+            context = self.context(stream)
+            tracks, to_embed = self.plan_embeddings(context, frame, face_locations, gallery)
+            plans.append((context, face_locations, tracks, to_embed))
+
+        user_ids, distances = [], []
+        crops = [(frame, face_locations[to_embed]) for frame, (_, face_locations, _, to_embed) in zip(frames, plans)]
+        if any(len(boxes) for _, boxes in crops):
+            with EMBED_SECONDS.time(), torch.profiler.record_function('resnet'):
+                faces = self.cropper.crop_many(crops).to(self.device)
+                if self.acceleration['channels_last']:
+                    faces = faces.contiguous(memory_format=torch.channels_last)
+                with self.inference():
+                    img_embeddings = self.resnet(faces).cpu()
+            with MATCH_SECONDS.time(), torch.profiler.record_function('gallery.match'):
+                user_ids, distances = self.match_embeddings(img_embeddings, gallery)
+
+        results, offset = [], 0
+        for frame, roi, overview, (context, face_locations, tracks, to_embed) in zip(frames, rois, overviews, plans):
+            embedded = zip(to_embed, user_ids[offset:offset + len(to_embed)], distances[offset:offset + len(to_embed)])
+            offset += len(to_embed)
+            if tracks is None:
+                frame_ids = [0] * len(face_locations)
+                for i, user_id, _ in embedded:
+                    frame_ids[i] = user_id
+            else:
+                for i, user_id, distance in embedded:
+                    context.tracker.assign(tracks[i], user_id, distance)
+                frame_ids = [track.user_id for track in tracks]
+
+            # Faces outside the zones are only drawn, so they are not embedded and stay unrecognized
+            outside = self.overview_faces(context, frame, roi, overview)
+            if len(outside):
+                frame_ids, face_locations = frame_ids + [0] * len(outside), np.concatenate([face_locations, outside])
+            results.append((frame_ids, face_locations) if len(face_locations) else ([], []))
+        return results
+
+    def recognize_images(self, images):
+        """Detect and recognize faces on independent RGB images without tracking, returning (IDs, boxes, distances) each.
+
+        Images of the same size share one MTCNN pass and the faces of all images are embedded in one
+        forward pass.
+        """
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+        boxes = [np.empty((0, 4), dtype=np.float32)] * len(images)
+        with self.inference(), torch.profiler.record_function('mtcnn.detect'):
+            for indices in groups.values():
+                found, _ = self.mtcnn.detect([images[i] for i in indices], landmarks=False)
+                for i, image_boxes in zip(indices, found):
+                    if image_boxes is not None:
+                        height, width = images[i].shape[:2]
+                        boxes[i] = np.array([box for box in image_boxes if self.cropper.fits(box, width, height)],
+                                            dtype=np.float32).reshape(-1, 4)
+
+        user_ids, distances = [], []
+        if any(len(image_boxes) for image_boxes in boxes):
+            with torch.profiler.record_function('resnet'):
+                faces = self.image_cropper.crop_many(list(zip(images, boxes))).to(self.device)
+                if self.acceleration['channels_last']:
+                    faces = faces.contiguous(memory_format=torch.channels_last)
+                with self.inference():
+                    img_embeddings = self.resnet(faces).cpu()
+            with torch.profiler.record_function('gallery.match'):
+                user_ids, distances = self.match_embeddings(img_embeddings)
+
+        results, offset = [], 0
+        for image_boxes in boxes:
+            end = offset + len(image_boxes)
+            results.append((user_ids[offset:end], image_boxes, distances[offset:end]))
+            offset = end
+        return results
+
+    def detect_faces(self, frame: np.ndarray, roi=None, stream='default'):
+        """Detect faces in frame (only inside roi, if given) and match with known faces"""
+        return self.detect_faces_batch([frame], [roi], [stream])[0]
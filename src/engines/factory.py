@@ -1,12 +1,27 @@
-from src.engines import FaceEngine, FacenetEngine, FaceRecognitionEngine
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.engines.base import FaceEngine
+
+
+def engine_class(config) -> type:
+    """Engine class for the configured mode, or the client of a worker process running it"""
+    if (config.get('worker') or {}).get('enabled'):
+        from src.engines.remote import RemoteEngine
+        return RemoteEngine
 
-def get_engine(config, users, camera) -> FaceEngine:
-    """Factory function to create appropriate face recognition engine"""
     mode = config["mode"]
 
     if mode == "facenet":
-        return FacenetEngine(config, users, camera)
+        from src.engines.facenet import FacenetEngine
+        return FacenetEngine
     elif mode == "face_recognition":
-        return FaceRecognitionEngine(config, users, camera)
+        from src.engines.face_recognition import FaceRecognitionEngine
+        return FaceRecognitionEngine
     else:
         raise ValueError(f"Unknown mode: {mode}")
+
+
+def get_engine(config, users, camera) -> "FaceEngine":
+    """Factory function to create appropriate face recognition engine"""
+    return engine_class(config)(config, users, camera)
@@ -0,0 +1,111 @@
+import math
+from typing import List, NamedTuple
+
+import numpy as np
+import torch
+
+METRICS = ('l2', 'cosine')
+
+
+class MatchResult(NamedTuple):
+    """Best gallery match for every query face"""
+    ids: List  # best matching user ID per face (None for an empty gallery)
+    distances: np.ndarray  # distance to the best match
+    margins: np.ndarray  # runner-up user's distance minus best distance (inf if no runner-up)
+
+
+class Gallery:
+    """Enrolled embeddings held as one contiguous matrix with a parallel ID array.
+
+    A user may own several rows (templates, e.g. photos with and without glasses); a user's distance
+    to a face is that of their closest template.
+    """
+
+    def __init__(self, ids, matrix, metric='l2', index=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.metric = metric
+        self.ids = np.empty(len(ids), dtype=object)
+        self.ids[:] = list(ids)
+        # Row -> position of its user in user_ids, so the templates of a user count as one candidate
+        positions = {}
+        self.owner = torch.tensor([positions.setdefault(id, len(positions)) for id in self.ids], dtype=torch.long)
+        self.user_ids = np.empty(len(positions), dtype=object)
+        self.user_ids[:] = list(positions)
+        self.templates = len(self.user_ids) < len(self.ids)  # some user has more than one row
+        self.matrix = torch.as_tensor(matrix, dtype=torch.float32)
+        if self.matrix.ndim != 2:
+            self.matrix = self.matrix.reshape(len(self.ids), -1)
+        self.matrix = self.matrix.contiguous()
+        if metric == 'cosine':
+            self.matrix = torch.nn.functional.normalize(self.matrix, dim=1)
+        # Squared row norms are constant for the gallery, so compute them once
+        self.sq_norms = (self.matrix * self.matrix).sum(dim=1)
+
+        if index is None:
+            from src.engines.index import ExactIndex
+            index = ExactIndex()
+        self.index = index
+        self.index.build(self)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def updated(self, upsert_ids, upsert_matrix, remove_ids):
+        """New gallery with the given identities added/replaced and removed, leaving this one untouched"""
+        drop = set(remove_ids) | set(upsert_ids)
+        keep = np.fromiter((i for i, id in enumerate(self.ids) if id not in drop), dtype=np.intp)
+        matrix = self.matrix[keep]
+        if len(upsert_ids):
+            upserts = self.prepare(upsert_matrix)
+            matrix = torch.cat([matrix, upserts]) if len(keep) else upserts  # an empty gallery has no width yet
+        return Gallery(list(self.ids[keep]) + list(upsert_ids), matrix, self.metric, self.index.derive(keep))
+
+    def prepare(self, queries):
+        """Bring query embeddings into the gallery's (n, dim) float32 layout"""
+        queries = torch.as_tensor(queries, dtype=torch.float32)
+        # An empty gallery takes the width of the embeddings it is given
+        queries = queries.reshape(-1, self.matrix.shape[1] if len(self) else queries.shape[-1])
+        if self.metric == 'cosine':
+            queries = torch.nn.functional.normalize(queries, dim=1)
+        return queries
+
+    def distances(self, queries, rows=None):
+        """Distances between every query and every gallery row (or the given subset of rows)"""
+        queries = self.prepare(queries)
+        matrix, sq_norms = self.matrix, self.sq_norms
+        if rows is not None:
+            matrix, sq_norms = matrix[rows], sq_norms[rows]
+        if self.metric == 'cosine':
+            return 1 - queries @ matrix.T
+        # |q - g|^2 = |q|^2 + |g|^2 - 2 q.g computed as a single matrix product
+        sq = (queries * queries).sum(dim=1, keepdim=True) + sq_norms - 2 * queries @ matrix.T
+        return sq.clamp_(min=0).sqrt_()
+
+    def nearest(self, distances, k, rows=None):
+        """(distances, user positions) of the k nearest users, from query distances to all rows or the given rows"""
+        if self.templates:
+            # Reduce over the users owning the candidate rows only, not over every user of the gallery;
+            # rows then holds those users' positions, which the local indices map back to
+            if rows is None:
+                owner, users = self.owner, len(self.user_ids)
+            else:
+                rows, owner = torch.unique(self.owner[rows], return_inverse=True)
+                users = len(rows)
+            distances = torch.full((len(distances), users), math.inf).scatter_reduce_(
+                1, owner.expand(len(distances), -1), distances, 'amin')
+        top, idx = distances.topk(min(k, distances.shape[1]), dim=1, largest=False)
+        return top, idx if rows is None else rows[idx]
+
+    def match(self, queries) -> MatchResult:
+        """Match all query embeddings at once, returning best ID, distance and runner-up margin"""
+        n = len(queries)
+        if n == 0 or len(self) == 0:
+            return MatchResult([None] * n, np.full(n, np.inf), np.full(n, np.inf))
+
+        with torch.no_grad():
+            top, idx = self.index.search(self, queries, min(2, len(self.user_ids)))
+        top = top.numpy()
+        best = top[:, 0]
+        margins = top[:, 1] - best if top.shape[1] > 1 else np.full(n, np.inf)
+        return MatchResult(list(self.user_ids[idx[:, 0].numpy()]), best, margins)
@@ -0,0 +1,235 @@
+import argparse
+import math
+import time
+
+import numpy as np
+import torch
+
+from src.engines.gallery import Gallery
+
+
+def nearest_centroids(vectors, centroids, k=1):
+    """Indices of the k closest centroids per vector, via |c|^2 - 2 v.c (|v|^2 does not change the order)"""
+    scores = (centroids * centroids).sum(dim=1) - 2 * vectors @ centroids.T
+    return scores.topk(k, dim=1, largest=False).indices
+
+
+class ExactIndex:
+    """Brute-force search over every gallery row"""
+
+    def build(self, gallery):
+        pass
+
+    def derive(self, keep):
+        return ExactIndex()
+
+    def search(self, gallery, queries, k):
+        """Return (distances, user positions) of the k nearest gallery users per query"""
+        return gallery.nearest(gallery.distances(queries), k)
+
+
+class IVFIndex:
+    """Inverted-file index: k-means partitions of the gallery, searching only the nprobe closest ones"""
+
+    def __init__(self, nlist=0, nprobe=8, iterations=10, seed=0):
+        self.nlist = nlist  # 0 picks 4 * sqrt(gallery size)
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self.assignment = None
+        self.lists = []
+
+    def derive(self, keep):
+        """Copy for a gallery that starts with the kept rows of this one, reusing centroids and assignments"""
+        index = IVFIndex(self.nlist, self.nprobe, self.iterations, self.seed)
+        if self.centroids is not None:
+            index.centroids, index.trained_size = self.centroids, self.trained_size
+            index.assignment = self.assignment[torch.as_tensor(keep, dtype=torch.long)]
+        return index
+
+    def build(self, gallery):
+        """Train centroids with k-means and assign every gallery row to its nearest partition"""
+        n = len(gallery)
+        if n == 0:
+            self.centroids, self.assignment, self.lists = None, None, []
+            return
+        if self.assignment is not None and self.trained_size / 2 <= n <= self.trained_size * 2:
+            # Derived index: only the appended rows need a partition, unless the gallery size drifted a lot
+            added = nearest_centroids(gallery.matrix[len(self.assignment):], self.centroids)[:, 0]
+            self.assignment = torch.cat([self.assignment, added])
+            self.make_lists()
+            return
+        nlist = min(self.nlist or int(4 * math.sqrt(n)), n)
+        generator = torch.Generator().manual_seed(self.seed)
+
+        # Train on a bounded sample, the partitions do not improve much beyond ~32 points per list
+        sample = gallery.matrix[torch.randperm(n, generator=generator)[:32 * nlist]]
+        centroids = sample[:nlist].clone()
+        for _ in range(self.iterations):
+            assign = nearest_centroids(sample, centroids)[:, 0]
+            sums = torch.zeros_like(centroids).index_add_(0, assign, sample)
+            counts = torch.bincount(assign, minlength=nlist).unsqueeze(1)
+            centroids = torch.where(counts > 0, sums / counts.clamp(min=1), centroids)
+        self.centroids, self.trained_size = centroids, n
+        self.assignment = torch.cat([nearest_centroids(chunk, centroids)[:, 0]
+                                     for chunk in gallery.matrix.split(65536)])
+        self.make_lists()
+
+    def make_lists(self):
+        """Group row indices by partition"""
+        order = torch.argsort(self.assignment, stable=True)
+        counts = torch.bincount(self.assignment, minlength=len(self.centroids)).tolist()
+        self.lists = list(order.split(counts))
+
+    def search(self, gallery, queries, k):
+        """Return (distances, user positions) of the k nearest users among the rows of the probed partitions"""
+        queries = gallery.prepare(queries)
+        probes = nearest_centroids(queries, self.centroids, min(self.nprobe, len(self.centroids)))
+        distances = torch.full((len(queries), k), math.inf)
+        indices = torch.zeros((len(queries), k), dtype=torch.long)
+        for i, probe in enumerate(probes.tolist()):
+            rows = torch.cat([self.lists[p] for p in probe])
+            if len(rows) == 0:
+                continue
+            top, idx = gallery.nearest(gallery.distances(queries[i:i + 1], rows), k, rows)
+            distances[i, :top.shape[1]] = top[0]
+            indices[i, :top.shape[1]] = idx[0]
+        return distances, indices
+
+
+class CentroidIndex:
+    """Multi-template search: shortlist the users closest by centroid (mean template), then compare their templates.
+
+    Costs about one distance per user plus one per shortlisted template, instead of one per template.
+    """
+
+    def __init__(self, shortlist=8):
+        self.shortlist = shortlist
+        self.centroids = None
+        self.rows = []  # gallery rows of every user, by user position
+
+    def derive(self, keep):
+        return CentroidIndex(self.shortlist)  # centroids take one pass over the matrix, cheaper than tracking them
+
+    def build(self, gallery):
+        """Average the templates of every user and group their row indices"""
+        if len(gallery) == 0:
+            self.centroids, self.rows = None, []
+            return
+        users = len(gallery.user_ids)
+        counts = torch.bincount(gallery.owner, minlength=users)
+        sums = torch.zeros(users, gallery.matrix.shape[1]).index_add_(0, gallery.owner, gallery.matrix)
+        self.centroids = sums / counts.unsqueeze(1)
+        if gallery.metric == 'cosine':
+            self.centroids = torch.nn.functional.normalize(self.centroids, dim=1)
+        self.rows = list(torch.argsort(gallery.owner, stable=True).split(counts.tolist()))
+
+    def search(self, gallery, queries, k):
+        """Return (distances, user positions) of the k nearest users among the shortlisted ones"""
+        queries = gallery.prepare(queries)
+        shortlists = nearest_centroids(queries, self.centroids, min(max(self.shortlist, k), len(self.centroids)))
+        distances = torch.full((len(queries), k), math.inf)
+        indices = torch.zeros((len(queries), k), dtype=torch.long)
+        for i, users in enumerate(shortlists.tolist()):
+            rows = torch.cat([self.rows[user] for user in users])
+            top, idx = gallery.nearest(gallery.distances(queries[i:i + 1], rows), k, rows)
+            distances[i, :top.shape[1]] = top[0]
+            indices[i, :top.shape[1]] = idx[0]
+        return distances, indices
+
+
+INDEXES = {'exact': ExactIndex, 'ivf': IVFIndex, 'centroid': CentroidIndex}
+PARAMETERS = {'exact': (), 'ivf': ('nlist', 'nprobe', 'iterations', 'seed'), 'centroid': ('shortlist',)}
+
+
+def get_index(index_config):
+    """Factory function to create the gallery index selected in config"""
+    index_config = dict(index_config or {})
+    index_type = index_config.pop('type', 'exact')
+    if index_type not in INDEXES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    # The config holds the settings of every index type, each takes its own
+    return INDEXES[index_type](**{key: value for key, value in index_config.items() if key in PARAMETERS[index_type]})
+
+
+def evaluate(gallery, queries, index, threshold, repeats=3):
+    """Compare an index against exact search: recall@1, threshold-decision agreement and latency"""
+    exact = gallery.match(queries)
+    candidate = Gallery(gallery.ids, gallery.matrix, gallery.metric)
+    candidate.index = index  # already trained, so evaluating several nprobe values reuses one k-means run
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        approx = candidate.match(queries)
+    latency = (time.perf_counter() - start) / repeats / len(queries)
+
+    exact_ids = [id if d < threshold else None for id, d in zip(exact.ids, exact.distances)]
+    approx_ids = [id if d < threshold else None for id, d in zip(approx.ids, approx.distances)]
+    return {
+        'recall': float(np.mean([a == b for a, b in zip(exact.ids, approx.ids)])),
+        'decision_agreement': float(np.mean([a == b for a, b in zip(exact_ids, approx_ids)])),
+        'latency_ms': latency * 1000,
+    }
+
+
+def report(gallery, queries, threshold, nlist=0, nprobes=(1, 2, 4, 8, 16, 32), shortlists=(1, 2, 4, 8, 16)):
+    """Print recall vs latency for exact search and a range of IVF (and, for templates, centroid) operating points"""
+    exact = evaluate(gallery, queries, ExactIndex(), threshold)
+    print(f"gallery={len(gallery)} users={len(gallery.user_ids)} queries={len(queries)} threshold={threshold}")
+    print(f"{'index':<16}{'recall@1':>10}{'agreement':>11}{'ms/query':>10}")
+    print(f"{'exact':<16}{exact['recall']:>10.4f}{exact['decision_agreement']:>11.4f}{exact['latency_ms']:>10.3f}")
+
+    index = IVFIndex(nlist=nlist)
+    index.build(Gallery(gallery.ids, gallery.matrix, gallery.metric))
+    for nprobe in nprobes:
+        index.nprobe = nprobe
+        result = evaluate(gallery, queries, index, threshold)
+        print(f"{f'ivf nprobe={nprobe}':<16}{result['recall']:>10.4f}"
+              f"{result['decision_agreement']:>11.4f}{result['latency_ms']:>10.3f}")
+
+    if not gallery.templates:
+        return
+    index = CentroidIndex()
+    index.build(gallery)
+    for shortlist in shortlists:
+        index.shortlist = shortlist
+        result = evaluate(gallery, queries, index, threshold)
+        print(f"{f'centroid sl={shortlist}':<16}{result['recall']:>10.4f}"
+              f"{result['decision_agreement']:>11.4f}{result['latency_ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    from src.engines.store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description="Report recall vs latency of gallery index settings")
+    parser.add_argument('--embedding-folder', help="Embedding store to evaluate")
+    parser.add_argument('--synthetic', type=int, default=0, help="Use a random gallery of this size instead")
+    parser.add_argument('--templates', type=int, default=1, help="Templates per user of the random gallery")
+    parser.add_argument('--variation', type=float, default=0.8,
+                        help="Std of the differences between the templates of a random user")
+    parser.add_argument('--queries', type=int, default=500, help="Number of probe faces drawn from the gallery")
+    parser.add_argument('--noise', type=float, default=0.5, help="Std of the noise added to probe embeddings")
+    parser.add_argument('--threshold', type=float, default=1.0, help="facenet.threshold to check decisions against")
+    parser.add_argument('--metric', default='l2')
+    parser.add_argument('--nlist', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        matrix = torch.nn.functional.normalize(torch.randn(args.synthetic, 512), dim=1)
+        ids = list(range(1, args.synthetic + 1))
+        if args.templates > 1:
+            # Photos of one person (glasses, beard, lighting) spread around a common center
+            variation = args.variation * torch.randn(args.synthetic, args.templates, 512) / math.sqrt(512)
+            matrix = torch.nn.functional.normalize(matrix.unsqueeze(1) + variation, dim=2).reshape(-1, 512)
+            ids = [id for id in ids for _ in range(args.templates)]
+    else:
+        ids, matrix = EmbeddingStore(args.embedding_folder).read()
+    gallery = Gallery(ids, matrix, args.metric)
+
+    # Probes are noisy copies of enrolled faces, renormalized like InceptionResnetV1 outputs
+    rows = torch.randint(len(gallery), (args.queries,))
+    probes = gallery.matrix[rows] + args.noise * torch.randn(args.queries, gallery.matrix.shape[1]) / math.sqrt(
+        gallery.matrix.shape[1])
+    report(gallery, torch.nn.functional.normalize(probes, dim=1), args.threshold, args.nlist)
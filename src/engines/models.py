@@ -0,0 +1,53 @@
+import logging
+import os
+import threading
+
+import torch
+from facenet_pytorch import MTCNN, InceptionResnetV1
+from torch.hub import download_url_to_file
+
+from src.engines.accelerate import DEFAULTS, accelerate
+
+logger = logging.getLogger(__name__)
+
+# Release files of the pretrained InceptionResnetV1 weights, as fetched by facenet_pytorch
+WEIGHTS_URL = 'https://github.com/timesler/facenet-pytorch/releases/download/v2.2.9/'
+WEIGHT_FILES = {'vggface2': '20180402-114759-vggface2.pt', 'casia-webface': '20180408-102900-casia-webface.pt'}
+
+_models = {}
+_lock = threading.Lock()
+
+
+def load_resnet(pretrained, weights_dir=None):
+    """InceptionResnetV1 with weights from weights_dir (downloaded there once), or from the torch hub cache"""
+    if not weights_dir or pretrained not in WEIGHT_FILES:
+        return InceptionResnetV1(pretrained=pretrained)
+
+    path = os.path.join(weights_dir, WEIGHT_FILES[pretrained])
+    if not os.path.exists(path):
+        logger.info("Downloading %s weights to %s", pretrained, path)
+        os.makedirs(weights_dir, exist_ok=True)
+        download_url_to_file(WEIGHTS_URL + WEIGHT_FILES[pretrained], path)
+    state = torch.load(path, map_location='cpu')
+    resnet = InceptionResnetV1()
+    # The classifier of the training identities is not needed for embeddings
+    resnet.load_state_dict({name: value for name, value in state.items() if not name.startswith('logits.')})
+    return resnet
+
+
+def get_models(device, pretrained='vggface2', acceleration=None, weights_dir=None):
+    """Return (resnet, mtcnn) for the given settings, loading weights at most once per process"""
+    acceleration = {**DEFAULTS, **(acceleration or {})}
+    key = (str(device), pretrained, tuple(sorted(acceleration.items())), weights_dir)
+    with _lock:
+        if key not in _models:
+            # Face embedding model
+            resnet = load_resnet(pretrained, weights_dir).to(device).eval()
+            # Face detection model
+            mtcnn = MTCNN(
+                image_size=160, margin=0, min_face_size=20,
+                thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True, keep_all=True,
+                device=device
+            )
+            _models[key] = accelerate(resnet, mtcnn, acceleration, device)
+        return _models[key]
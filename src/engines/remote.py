@@ -0,0 +1,350 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_DEFAULTS = {'slots': 8, 'timeout': 10.0, 'start_timeout': 120.0, 'restart_delay': 1.0}
+
+WORKER_UP = metrics.gauge('facegate_worker_up', "1 while the inference worker process runs and answers")
+WORKER_RESTARTS = metrics.counter('facegate_worker_restarts_total', "Inference worker restarts after a crash or hang")
+
+_engines = []  # running remote engines, whose worker metrics are mirrored on every scrape
+
+
+class WorkerUnavailable(RuntimeError):
+    """The inference worker crashed, stopped answering or is being restarted"""
+
+
+class FrameRing:
+    """Fixed-size frame slots in one shared memory block, written in turn by the server and read in place by the worker"""
+
+    def __init__(self, slots, slot_bytes, name=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.memory = shared_memory.SharedMemory(name, create=name is None, size=slots * slot_bytes)
+        self.position = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def write(self, frame):
+        """Copy a frame into the next slot and return the slot index"""
+        slot = self.position
+        self.position = (self.position + 1) % self.slots
+        self.view(slot, frame.shape, frame.dtype)[...] = frame
+        return slot
+
+    def view(self, slot, shape, dtype=np.uint8):
+        return np.ndarray(shape, dtype, buffer=self.memory.buf, offset=slot * self.slot_bytes)
+
+    def close(self, unlink=False):
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class Worker:
+    """Worker process side: the in-process engine and the frame ring it reads from"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.ring = None
+        self.prepared = None  # (token, gallery) loaded by load_embeddings, until apply_config switches to it
+
+    def detect(self, ring_name, slots, slot_bytes, items):
+        if self.ring is None or self.ring.name != ring_name:
+            if self.ring is not None:
+                self.ring.close()
+            self.ring = FrameRing(slots, slot_bytes, ring_name)
+        frames = [self.ring.view(slot, shape, dtype) for slot, shape, dtype, _, _, _, _ in items]
+        return self.engine.detect_faces_batch(frames, [item[3] for item in items], [item[4] for item in items],
+                                              [item[5] for item in items], [item[6] for item in items])
+
+    def recognize_images(self, images):
+        return self.engine.recognize_images(images)
+
+    def warm_up(self, frame_sizes):
+        self.engine.warm_up(frame_sizes)
+
+    def load_embeddings(self, token, users, config):
+        self.prepared = token, self.engine.load_embeddings(users, config)
+
+    def apply_config(self, config, token, users):
+        gallery = None
+        if token is not None:
+            prepared, self.prepared = self.prepared, None
+            # Loaded by a previous worker process if this one was restarted in between
+            gallery = prepared[1] if prepared and prepared[0] == token else self.engine.load_embeddings(users, config)
+        self.engine.apply_config(config, gallery)
+
+    def sync(self, users):
+        return self.engine.sync(users)
+
+    def stats(self):
+        return self.engine.stats()
+
+    def remove_stream(self, stream):
+        self.engine.remove_stream(stream)
+
+    def metrics(self):
+        return metrics.snapshot()
+
+
+COMMANDS = ('detect', 'recognize_images', 'warm_up', 'load_embeddings', 'apply_config', 'sync', 'stats',
+            'remove_stream', 'metrics')
+
+
+def serve(conn, config, users, frame_sizes):
+    """Worker process main: builds the engine, then answers commands from the server until stopped"""
+    from src.engines.factory import get_engine
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the server, which stops the worker
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s worker %(levelname)s %(name)s: %(message)s')
+    try:
+        worker = Worker(get_engine({**config, 'worker': {'enabled': False}}, users, None))
+        if frame_sizes:
+            worker.warm_up(frame_sizes)
+    except Exception as exc:
+        conn.send(('error', f'{type(exc).__name__}: {exc}'))
+        return
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            command, args = conn.recv()
+        except EOFError:
+            break  # the server is gone
+        if command == 'stop':
+            break
+        try:
+            if command not in COMMANDS:
+                raise ValueError(f"Unknown command: {command}")
+            conn.send(('ok', getattr(worker, command)(*args)))
+        except Exception as exc:
+            logger.exception("Error running %s: %s", command, exc)
+            conn.send(('error', f'{type(exc).__name__}: {exc}'))
+
+
+class RemoteEngine:
+    """Face engine running in a separate worker process, with frames passed through shared memory.
+
+    Offers the FaceEngine methods the server uses, so PyTorch never holds the server's GIL. A worker
+    that crashes or stops answering is replaced in the background; until then frames get no faces,
+    while the web server, cameras and video feeds keep running.
+    """
+
+    def __init__(self, config, users, camera=None):
+        self.config = config
+        self.users = users
+        self.settings = {**WORKER_DEFAULTS, **(config.get('worker') or {})}
+        self.sizes = []  # frame sizes to warm up, also on restart
+        self.lock = threading.Lock()  # one command in flight, so a frame slot is never overwritten while read
+        self.context = multiprocessing.get_context('spawn')  # forking a process that runs threads is unsafe
+        self.ring = None
+        self.tokens = itertools.count(1)
+        self.pending = None  # (token, users) of a gallery loaded in the worker but not applied yet
+        self.restarts = 0
+        self.closed = False
+        self.process, self.conn = self.spawn()
+        _engines.append(self)
+
+    @classmethod
+    def preload(cls, config):
+        """Models are loaded by the worker process"""
+        pass
+
+    def spawn(self):
+        """Start a worker process and wait until its engine is loaded and warmed up"""
+        conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=serve, args=(child_conn, self.config, self.users, self.sizes),
+                                       name='inference-worker', daemon=True)
+        process.start()
+        child_conn.close()
+        try:
+            if not conn.poll(self.settings['start_timeout']):
+                raise RuntimeError(f"no answer within {self.settings['start_timeout']}s")
+            status, result = conn.recv()
+            if status == 'error':
+                raise RuntimeError(result)
+        except Exception as exc:
+            process.kill()
+            process.join()
+            conn.close()
+            raise RuntimeError(f"Inference worker failed to start: {exc}") from exc
+        logger.info("Inference worker %d ready", result)
+        WORKER_UP.set(1)
+        return process, conn
+
+    def request(self, command, *args):
+        """Run a command in the worker (call with the lock held); raises WorkerUnavailable if it is down"""
+        if self.conn is None:
+            raise WorkerUnavailable("Inference worker is restarting")
+        try:
+            self.conn.send((command, args))
+            if not self.conn.poll(self.settings['timeout']):
+                raise TimeoutError(f"no answer within {self.settings['timeout']}s")
+            status, result = self.conn.recv()
+        except (EOFError, OSError, TimeoutError) as exc:
+            self.fail(exc)
+            raise WorkerUnavailable(f"Inference worker failed: {exc}") from exc
+        if status == 'error':
+            raise RuntimeError(f"Inference worker: {result}")
+        return result
+
+    def call(self, command, *args):
+        with self.lock:
+            return self.request(command, *args)
+
+    def fail(self, exc):
+        """Kill a crashed or hung worker and restart it in the background (call with the lock held)"""
+        process = self.process
+        logger.error("Inference worker %d failed (%s), restarting", process.pid, exc)
+        process.kill()
+        self.conn.close()
+        self.process = self.conn = None
+        WORKER_UP.set(0)
+        threading.Thread(target=self.restart, args=(process,), name='worker-restart', daemon=True).start()
+
+    def restart(self, process):
+        process.join()
+        while not self.closed:
+            time.sleep(self.settings['restart_delay'])
+            try:
+                # Starts from the current config, users and frame sizes
+                new_process, conn = self.spawn()
+            except Exception as exc:
+                logger.error("%s, retrying", exc)
+                continue
+            with self.lock:
+                if not self.closed:
+                    self.process, self.conn = new_process, conn
+                    self.restarts += 1
+                    WORKER_RESTARTS.inc()
+                    return
+            conn.send(('stop', ()))  # closed while restarting
+            new_process.join()
+
+    def frame_ring(self, frame_bytes):
+        """The shared frame ring, replaced by a larger one when frames do not fit its slots"""
+        if self.ring is None or self.ring.slot_bytes < frame_bytes:
+            if self.ring is not None:
+                self.ring.close(unlink=True)  # the worker keeps its mapping until it attaches the new ring
+            self.ring = FrameRing(self.settings['slots'], frame_bytes)
+        return self.ring
+
+    def detect_faces_batch(self, frames, rois=None, streams=None, min_faces=None, overviews=None):
+        """Detect and recognize faces in the worker, at most `slots` frames per request"""
+        rois = rois or [None] * len(frames)
+        streams = streams or ['default'] * len(frames)
+        min_faces = min_faces or [None] * len(frames)
+        overviews = overviews or [None] * len(frames)
+        slots = self.settings['slots']
+        results = []
+        for start in range(0, len(frames), slots):
+            end = start + slots
+            results += self.detect_chunk(frames[start:end], rois[start:end], streams[start:end], min_faces[start:end],
+                                         overviews[start:end])
+        return results
+
+    def detect_chunk(self, frames, rois, streams, min_faces, overviews):
+        with self.lock:
+            if self.conn is None:
+                return [([], [])] * len(frames)  # restarting: no faces, the feeds stay live
+            ring = self.frame_ring(max(frame.nbytes for frame in frames))
+            items = [(ring.write(frame), frame.shape, frame.dtype.str, roi, stream, min_face, overview)
+                     for frame, roi, stream, min_face, overview in zip(frames, rois, streams, min_faces, overviews)]
+            try:
+                return self.request('detect', ring.name, ring.slots, ring.slot_bytes, items)
+            except WorkerUnavailable:
+                return [([], [])] * len(frames)
+
+    def detect_faces(self, frame, roi=None, stream='default'):
+        return self.detect_faces_batch([frame], [roi], [stream])[0]
+
+    def recognize_images(self, images):
+        """Recognize uploaded images in the worker; they are pickled, the frame ring is kept for the live frames"""
+        return self.call('recognize_images', images)
+
+    def warm_up(self, frame_sizes):
+        self.sizes = sorted(set(frame_sizes))
+        with self.lock:
+            if self.sizes:
+                self.frame_ring(max(width * height * 3 for width, height in self.sizes))
+            self.request('warm_up', self.sizes)
+
+    def load_embeddings(self, users, config=None):
+        """Load a gallery in the worker for apply_config to switch to; returns its token"""
+        token = next(self.tokens)
+        self.call('load_embeddings', token, users, config or self.config)
+        self.pending = token, users
+        return token
+
+    def apply_config(self, config, gallery=None):
+        """Switch the worker to a new config, and to the gallery loaded by load_embeddings if given"""
+        self.config = config
+        if gallery is not None and self.pending and self.pending[0] == gallery:
+            self.users = self.pending[1]
+        try:
+            self.call('apply_config', config, gallery, self.users)
+        except WorkerUnavailable:
+            pass  # the restarted worker starts from the current config and users
+
+    def sync(self, users, lock=None):
+        """Sync the worker's gallery; config changes reach the worker one command at a time, so it needs no lock"""
+        report = self.call('sync', users)
+        self.users = users
+        return report
+
+    def stats(self):
+        try:
+            return self.call('stats')
+        except WorkerUnavailable:
+            return {}
+
+    def remove_stream(self, stream):
+        try:
+            self.call('remove_stream', stream)
+        except WorkerUnavailable:
+            pass  # a restarted worker has no state of removed streams
+
+    def close(self):
+        """Stop the worker process and free the frame ring"""
+        with self.lock:
+            self.closed = True
+            if self.conn is not None:
+                try:
+                    self.conn.send(('stop', ()))
+                except OSError:
+                    pass
+                self.process.join(2)
+                if self.process.is_alive():
+                    self.process.kill()
+                self.conn.close()
+                self.process = self.conn = None
+            if self.ring is not None:
+                self.ring.close(unlink=True)
+                self.ring = None
+        WORKER_UP.set(0)
+        if self in _engines:
+            _engines.remove(self)
+
+
+@metrics.collector
+def collect():
+    """Mirror the engine metrics (detection, embedding, matching times) recorded in the worker processes"""
+    for engine in list(_engines):
+        try:
+            metrics.mirror(engine.call('metrics'))
+        except RuntimeError:
+            pass
@@ -0,0 +1,131 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import pickle
+import struct
+
+import numpy as np
+
+MAGIC = b'FRGALLRY'
+VERSION = 2
+LEGACY_VERSION = 1  # IDs in a separate gallery_ids.json, still readable
+HEADER = struct.Struct('<8sIIQQ')  # magic, version, embedding dim, row count, ID index size in bytes (0 in version 1)
+HEADER_SIZE = 64  # header is padded so the matrix starts on an aligned offset
+MATRIX_FILE = 'gallery.bin'
+INDEX_FILE = 'gallery_ids.json'
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """Consolidated on-disk gallery: one file holding a memory-mappable float32 matrix followed by its ID index.
+
+    A user may own several rows (templates), one per enrolled photo; the index names the template of
+    every row so a re-enrolled photo replaces its own row only. Matrix and index are replaced together
+    by one rename, so a reader never pairs the rows of one write with the IDs of another.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.matrix_path = os.path.join(folder, MATRIX_FILE)
+        self.index_path = os.path.join(folder, INDEX_FILE)
+
+    def exists(self):
+        return os.path.exists(self.matrix_path)
+
+    def read(self):
+        """Return (ids, matrix) with the matrix memory-mapped copy-on-write, so loading copies nothing"""
+        ids, matrix, _ = self.load()
+        return ids, matrix
+
+    def templates(self):
+        """Template name of every row, the user ID itself in stores written before templates"""
+        return self.load()[2]
+
+    def load(self):
+        """Return (ids, matrix, template names), all from one open handle of the store file"""
+        with open(self.matrix_path, 'rb') as f:
+            magic, version, dim, count, index_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.matrix_path} is not an embedding store")
+            if version == VERSION:
+                f.seek(HEADER_SIZE + count * dim * np.dtype(np.float32).itemsize)
+                index = json.loads(f.read(index_size).decode('utf-8'))
+            elif version == LEGACY_VERSION:
+                with open(self.index_path, 'r', encoding='utf-8') as index_file:
+                    index = json.load(index_file)
+            else:
+                raise ValueError(f"Unsupported embedding store version {version} in {self.folder}")
+            if count != len(index['ids']):
+                raise ValueError(f"Embedding store {self.folder} is inconsistent: "
+                                 f"{count} rows but {len(index['ids'])} IDs")
+
+            if count == 0:
+                matrix = np.empty((0, dim), dtype=np.float32)
+            else:
+                # Mapping the open file, not the path, keeps the rows of this version even if it is replaced now
+                matrix = np.memmap(f, dtype=np.float32, mode='c', offset=HEADER_SIZE, shape=(count, dim))
+        return index['ids'], matrix, index.get('templates', index['ids'])
+
+    def write(self, ids, matrix, templates=None):
+        """Atomically replace the store contents with the given IDs, (n, dim) matrix and template names"""
+        ids = [str(i) for i in ids]
+        templates = [str(name) for name in templates] if templates is not None else ids
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(ids), -1)
+        os.makedirs(self.folder, exist_ok=True)
+
+        index = json.dumps({'ids': ids, 'templates': templates}).encode('utf-8')
+        header = HEADER.pack(MAGIC, VERSION, matrix.shape[1], matrix.shape[0], len(index)).ljust(HEADER_SIZE, b'\0')
+        with open(self.matrix_path + '.tmp', 'wb') as f:
+            f.write(header)
+            f.write(matrix.tobytes())
+            f.write(index)
+        os.replace(self.matrix_path + '.tmp', self.matrix_path)  # rows and IDs switch in one rename
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)  # left over from a version 1 store
+
+    def append(self, ids, matrix, templates=None):
+        """Add or overwrite rows by template (default: one per ID), rewriting the store in one pass"""
+        rows = {}  # template -> (ID, row)
+        if self.exists():
+            stored_ids, stored, stored_templates = self.load()
+            # Copy out of the mapping so the file can be replaced underneath it
+            rows = dict(zip(stored_templates, zip(stored_ids, np.array(stored))))
+            del stored
+        for id, template, row in zip(ids, templates or ids, np.asarray(matrix, dtype=np.float32)):
+            rows[str(template)] = (str(id), row)
+        matrix = np.stack([row for _, row in rows.values()]) if rows else np.empty((0, 0))
+        self.write([id for id, _ in rows.values()], matrix, list(rows.keys()))
+
+    def migrate(self):
+        """One-shot conversion of the legacy one-pickle-per-user folder into the store"""
+        ids, rows = [], []
+        for path in sorted(glob.glob(os.path.join(self.folder, '*'))):
+            if not os.path.isfile(path) or os.path.basename(path) in (MATRIX_FILE, INDEX_FILE):
+                continue
+            try:
+                with open(path, 'rb') as file:
+                    embedding = pickle.load(file)
+            except Exception as exc:
+                logger.warning("Skipping %s during migration: %s", path, exc)
+                continue
+            embedding = np.asarray(embedding.detach().cpu() if hasattr(embedding, 'detach') else embedding,
+                                   dtype=np.float32)
+            ids.append(os.path.basename(path))
+            rows.append(embedding.reshape(-1, embedding.shape[-1])[0])
+
+        self.write(ids, np.stack(rows) if rows else np.empty((0, 0)))
+        logger.info("Migrated %d embeddings from %s", len(ids), self.folder)
+        return len(ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a pickle-per-user embedding folder into an embedding store")
+    parser.add_argument('folder', help="Embedding folder, e.g. facenet_embeddings")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    EmbeddingStore(args.folder).migrate()
@@ -0,0 +1,151 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond matching up to slow door calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    """Named metric with optional labels, kept as plain numbers per label combination.
+
+    Updates take no lock: they run on the hot path and a rare lost increment between threads is
+    acceptable for monitoring.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, format_labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines += [f'{name}{labels} {format_value(value)}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Publish a total that is counted elsewhere (used by collectors)"""
+        self.values[self.key(labels)] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', format_labels(self.labelnames, key, [('le', format_value(bound))]), cumulative
+            yield f'{self.name}_sum', format_labels(self.labelnames, key), total
+            yield f'{self.name}_count', format_labels(self.labelnames, key), cumulative
+
+
+def register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return register(Histogram(name, documentation, labelnames, buckets))
+
+
+def snapshot():
+    """Definitions and values of the metrics recorded to, for another process to mirror"""
+    return [(metric.type, metric.name, metric.documentation, metric.labelnames, getattr(metric, 'buckets', None),
+             metric.values) for metric in _metrics if metric.values]
+
+
+def mirror(remote):
+    """Show metrics recorded in another process (its snapshot()), registering the ones unknown here"""
+    known = {metric.name: metric for metric in _metrics}
+    for kind, name, documentation, labelnames, buckets, values in remote:
+        metric = known.get(name)
+        if metric is None:
+            if kind == 'histogram':
+                metric = histogram(name, documentation, labelnames, buckets)
+            else:
+                metric = register({'counter': Counter, 'gauge': Gauge}[kind](name, documentation, labelnames))
+        metric.values = values
+
+
+def collector(func):
+    """Register a function that refreshes metrics from state kept elsewhere, called on every scrape"""
+    _collectors.append(func)
+    return func
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    for func in _collectors:
+        func()
+    return '\n'.join(metric.render() for metric in _metrics) + '\n'
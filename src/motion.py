@@ -0,0 +1,86 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Cheap change detector on a downscaled frame that decides when face detection is worth running"""
+
+    def __init__(self, config):
+        self.background = None
+        self.mask = None
+        self.mask_key = None
+        self.last_run = 0.0
+        self.active_until = 0.0
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.apply_config(config)
+
+    def apply_config(self, config):
+        motion_config = config.get('motion', {})
+        self.enabled = motion_config.get('enabled', False)
+        self.sensitivity = motion_config.get('sensitivity', 0.01)  # fraction of zone pixels that must change
+        self.pixel_threshold = motion_config.get('pixel_threshold', 25)  # intensity change counted as motion
+        self.heartbeat = motion_config.get('heartbeat', 1.0)  # seconds between detections on a static scene
+        self.hold = motion_config.get('hold', 2.0)  # seconds to keep detecting after motion or a face
+        self.width = motion_config.get('width', 160)
+        self.background = None
+
+    def region_mask(self, shape, frame_shape, regions):
+        """Boolean mask of the regions ([x1, y1, x2, y2] in frame pixels) on the downscaled frame"""
+        key = (shape, frame_shape, tuple(tuple(region) for region in regions))
+        if key != self.mask_key:
+            scale_x, scale_y = shape[1] / frame_shape[1], shape[0] / frame_shape[0]
+            self.mask = np.zeros(shape, dtype=bool)
+            for x1, y1, x2, y2 in regions:
+                self.mask[int(y1 * scale_y):int(np.ceil(y2 * scale_y)), int(x1 * scale_x):int(np.ceil(x2 * scale_x))] = True
+            if not self.mask.any():
+                self.mask[:] = True
+            self.mask_key = key
+        return self.mask
+
+    def motion_fraction(self, frame, regions):
+        """Share of region pixels that differ from the running background, which is then updated"""
+        height = max(int(frame.shape[0] * self.width / frame.shape[1]), 1)
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0).astype(np.float32)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return 1.0
+        mask = self.region_mask(gray.shape, frame.shape[:2], regions)
+        changed = np.abs(gray - self.background) > self.pixel_threshold
+        cv2.accumulateWeighted(gray, self.background, 0.05)
+        return float(changed[mask].mean())
+
+    def should_process(self, frame, regions, now=None):
+        """True if detection should run on this frame: motion in the regions, a recent face, or heartbeat.
+
+        `now` (seconds) defaults to the monotonic clock; recordings pass their own timestamps.
+        """
+        self.frames_seen += 1
+        if not self.enabled:
+            return True
+
+        now = time.monotonic() if now is None else now
+        if self.motion_fraction(frame, regions) >= self.sensitivity:
+            self.active_until = now + self.hold
+        if now < self.active_until or now - self.last_run >= self.heartbeat:
+            self.last_run = now
+            return True
+        self.frames_skipped += 1
+        return False
+
+    def report(self, faces_found, now=None):
+        """Keep detection running while faces are in view, even if they stand still"""
+        if faces_found:
+            self.active_until = (time.monotonic() if now is None else now) + self.hold
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'frames_seen': self.frames_seen,
+            'frames_skipped': self.frames_skipped,
+            'skipped_ratio': round(self.frames_skipped / self.frames_seen, 4) if self.frames_seen else 0.0,
+        }
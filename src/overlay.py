@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# BGR colors of the zone and face boxes
+EXIT_COLOR = (0, 0, 255)
+ENTRANCE_COLOR = (0, 128, 0)
+FACE_COLOR = (244, 133, 66)
+LABEL_COLOR = (255, 255, 255)
+
+
+class OverlayRenderer:
+    """Draws zones, face boxes and name labels straight onto BGR frames.
+
+    The zone layer is rendered once per frame size and zone layout, label bitmaps are rasterized
+    once per text, and face boxes are drawn with OpenCV, so no per-frame PIL round trip is needed.
+    """
+
+    def __init__(self, font_path=None, font_size=16, outline=3, radius=12, max_labels=256):
+        try:
+            self.font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default()
+        except Exception:
+            self.font = ImageFont.load_default()
+        self.outline = outline
+        self.radius = radius
+        self.max_labels = max_labels
+        self.labels = OrderedDict()  # text -> text mask, least recently used first
+        self.zone_key = None
+        self.zone_layer = None
+        self.zone_mask = None
+
+    def label_mask(self, text):
+        """Boolean bitmap of the rendered text, cached"""
+        mask = self.labels.get(text)
+        if mask is None:
+            width, height = self.font.getbbox(text)[2:]
+            image = Image.new('L', (max(width, 1), max(height, 1)))
+            ImageDraw.Draw(image).text((0, 0), text, font=self.font, fill=255)
+            mask = np.asarray(image) > 127
+            self.labels[text] = mask
+            if len(self.labels) > self.max_labels:
+                self.labels.popitem(last=False)
+        else:
+            self.labels.move_to_end(text)
+        return mask
+
+    def draw_label(self, frame, text, x, y, color=LABEL_COLOR):
+        """Blit the label with its top-left corner at (x, y), clipped to the frame"""
+        mask = self.label_mask(text)
+        height, width = frame.shape[:2]
+        x, y = max(x, 0), max(y, 0)
+        mask = mask[:max(height - y, 0), :max(width - x, 0)]
+        frame[y:y + mask.shape[0], x:x + mask.shape[1]][mask] = color
+
+    def draw_rounded_box(self, frame, box, color):
+        """Rounded rectangle outline; returns the clipped integer box or None if it is empty"""
+        coords = np.asarray(box, dtype=float)
+        if coords.shape != (4,) or not np.all(np.isfinite(coords)):
+            return None
+        height, width = frame.shape[:2]
+        x1, x2 = np.clip(sorted(coords[[0, 2]]), 0, width)
+        y1, y2 = np.clip(sorted(coords[[1, 3]]), 0, height)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        x1, y1, x2, y2 = (int(round(v)) for v in (x1, y1, x2, y2))
+
+        r = min(self.radius, (x2 - x1) // 2, (y2 - y1) // 2)
+        t = self.outline
+        cv2.line(frame, (x1 + r, y1), (x2 - r, y1), color, t)
+        cv2.line(frame, (x1 + r, y2), (x2 - r, y2), color, t)
+        cv2.line(frame, (x1, y1 + r), (x1, y2 - r), color, t)
+        cv2.line(frame, (x2, y1 + r), (x2, y2 - r), color, t)
+        if r > 0:
+            cv2.ellipse(frame, (x1 + r, y1 + r), (r, r), 180, 0, 90, color, t)
+            cv2.ellipse(frame, (x2 - r, y1 + r), (r, r), 270, 0, 90, color, t)
+            cv2.ellipse(frame, (x2 - r, y2 - r), (r, r), 0, 0, 90, color, t)
+            cv2.ellipse(frame, (x1 + r, y2 - r), (r, r), 90, 0, 90, color, t)
+        return x1, y1, x2, y2
+
+    def draw_labeled_box(self, frame, box, label, color):
+        drawn = self.draw_rounded_box(frame, box, color)
+        if drawn is not None and label is not None:
+            label_height = self.label_mask(label).shape[0]
+            self.draw_label(frame, label, drawn[0] + 8, max(drawn[1] - label_height - 10, 6))
+
+    def zones(self, shape, exit_area, entrance_area):
+        """Zone outlines and labels as a (layer, mask) pair, re-rendered only when size or zones change"""
+        key = (shape, tuple(exit_area), tuple(entrance_area))
+        if key != self.zone_key:
+            layer = np.zeros(shape, dtype=np.uint8)
+            self.draw_labeled_box(layer, exit_area, 'Exit', EXIT_COLOR)
+            self.draw_labeled_box(layer, entrance_area, 'Entrance', ENTRANCE_COLOR)
+            self.zone_layer, self.zone_mask = layer, layer.any(axis=2).astype(np.uint8)
+            self.zone_key = key
+        return self.zone_layer, self.zone_mask
+
+    def render(self, frame, exit_area, entrance_area, face_boxes, labels):
+        """Draw the zones and labeled face boxes on a copy of the frame"""
+        frame = frame.copy()
+        layer, mask = self.zones(frame.shape, exit_area, entrance_area)
+        cv2.copyTo(layer, mask, frame)
+        for box, label in zip(face_boxes, labels):
+            self.draw_labeled_box(frame, box, label, FACE_COLOR)
+        return frame
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LatestBuffer:
+    """Single-slot buffer between stages: a new item replaces an unconsumed one, which counts as dropped"""
+
+    def __init__(self, name):
+        self.name = name
+        self.ready = None  # event of the LatestGroup the buffer belongs to, set on every put
+        self.condition = threading.Condition()
+        self.item = None
+        self.has_item = False
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if self.has_item:
+                self.dropped += 1
+            self.item, self.has_item = item, True
+            self.put_count += 1
+            self.condition.notify()
+        if self.ready is not None:
+            self.ready.set()
+
+    def get(self, timeout=0.1):
+        """Take the freshest item, or return None if nothing arrived within timeout"""
+        with self.condition:
+            if not self.has_item:
+                self.condition.wait(timeout)
+            if not self.has_item:
+                return None
+            item, self.item, self.has_item = self.item, None, False
+            return item
+
+    def stats(self):
+        return {'depth': int(self.has_item), 'put': self.put_count, 'dropped': self.dropped}
+
+
+class LatestGroup:
+    """Several latest-wins buffers read together: waits until any of them has an item, then takes them all"""
+
+    def __init__(self, name):
+        self.name = name
+        self.ready = threading.Event()
+        self.members = {}
+
+    def add(self, key, buffer):
+        buffer.ready = self.ready
+        self.members[key] = buffer
+
+    def remove(self, key):
+        self.members.pop(key, None)
+
+    def get(self, timeout=0.1):
+        """Take the freshest item of every buffer that has one, as {key: item}, or None on timeout"""
+        if not self.ready.wait(timeout):
+            return None
+        self.ready.clear()
+        items = {key: buffer.get(timeout=0) for key, buffer in list(self.members.items())}
+        return {key: item for key, item in items.items() if item is not None} or None
+
+
+class Stage:
+    """Worker thread taking items from an input buffer, processing them and feeding output buffers"""
+
+    def __init__(self, name, func, source, outputs, stop_event):
+        self.name = name
+        self.func = func
+        self.source = source  # None for the first stage, which produces items on its own
+        self.outputs = outputs
+        self.stop_event = stop_event
+        self.stopped = False
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.last_latency = 0.0
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, name=f'stage-{name}', daemon=True)
+
+    def run(self):
+        while not self.stop_event.is_set() and not self.stopped:
+            if self.source is not None:
+                item = self.source.get()
+                if item is None:
+                    continue
+                args = (item,)
+            else:
+                args = ()
+
+            start = time.perf_counter()
+            try:
+                result = self.func(*args)
+            except Exception as exc:
+                self.errors += 1
+                logger.exception("Stage %s failed: %s", self.name, exc)
+                continue
+            self.last_latency = time.perf_counter() - start
+            self.busy_time += self.last_latency
+            self.processed += 1
+
+            if result is not None:
+                for output in self.outputs:
+                    output.put(result)
+        logger.info("Stage %s exited", self.name)
+
+    def join(self, timeout=None):
+        """Wait for the thread to finish its current item; True if it has exited or never started"""
+        if self.thread.ident is not None:
+            self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def stats(self):
+        uptime = time.perf_counter() - self.started
+        return {
+            'processed': self.processed,
+            'errors': self.errors,
+            'fps': round(self.processed / uptime, 2) if uptime > 0 else 0.0,
+            'avg_ms': round(1000 * self.busy_time / self.processed, 2) if self.processed else 0.0,
+            'last_ms': round(1000 * self.last_latency, 2),
+        }
+
+
+class Pipeline:
+    """Stages connected by latest-wins buffers, so each stage always works on the freshest item"""
+
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+        self.buffers = {}
+        self.stages = {}
+
+    def buffer(self, name):
+        self.buffers[name] = LatestBuffer(name)
+        return self.buffers[name]
+
+    def stage(self, name, func, source=None, outputs=()):
+        self.stages[name] = Stage(name, func, source, list(outputs), self.stop_event)
+        return self.stages[name]
+
+    def start(self):
+        """Start every stage that is not running yet, so stages can be added to a live pipeline"""
+        for stage in self.stages.values():
+            if stage.thread.ident is None:
+                stage.thread.start()
+
+    def remove(self, stage_names, buffer_names=()):
+        """Stop and drop stages and their buffers; returns the stages by name, to join as they finish their item"""
+        stopped = {name: self.stages.pop(name) for name in stage_names}
+        for stage in stopped.values():
+            stage.stopped = True
+        for name in buffer_names:
+            self.buffers.pop(name, None)
+        return stopped
+
+    def join(self, timeout=None):
+        for stage in self.stages.values():
+            if stage.thread.is_alive():
+                stage.thread.join(timeout)
+
+    def is_alive(self):
+        return any(stage.thread.is_alive() for stage in self.stages.values())
+
+    def stats(self):
+        return {
+            'stages': {name: stage.stats() for name, stage in list(self.stages.items())},
+            'buffers': {name: buffer.stats() for name, buffer in list(self.buffers.items())},
+        }
@@ -0,0 +1,104 @@
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+
+class ProfileSession:
+    """Profile of a fixed number of loop iterations: cProfile of the loop thread plus the torch operator profile"""
+
+    def __init__(self, iterations, use_torch=True):
+        self.iterations = iterations
+        self.remaining = iterations
+        self.use_torch = use_torch
+        self.python = cProfile.Profile()
+        self.torch = None
+        self.started = None
+        self.elapsed = 0.0
+        self.done = threading.Event()
+
+    def begin(self):
+        import torch  # not needed until a session runs
+
+        self.started = time.perf_counter()
+        if self.use_torch:
+            self.torch = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+            self.torch.__enter__()
+
+    def finish(self):
+        if self.torch is not None:
+            self.torch.__exit__(None, None, None)
+        self.elapsed = time.perf_counter() - self.started
+        self.done.set()
+
+    def summary(self):
+        out = io.StringIO()
+        out.write(f"{self.iterations - self.remaining} iterations in {self.elapsed:.3f}s\n\n")
+        pstats.Stats(self.python, stream=out).sort_stats('cumulative').print_stats(40)
+        if self.torch is not None:
+            out.write("\nTorch operators\n")
+            out.write(self.torch.key_averages().table(sort_by='cpu_time_total', row_limit=30))
+        return out.getvalue()
+
+    def archive(self):
+        """Zip with summary.txt, python.prof (pstats / snakeviz) and, with torch, torch_trace.json (chrome://tracing)"""
+        buffer = io.BytesIO()
+        with tempfile.TemporaryDirectory() as folder, zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('summary.txt', self.summary())
+            self.python.dump_stats(os.path.join(folder, 'python.prof'))
+            archive.write(os.path.join(folder, 'python.prof'), 'python.prof')
+            if self.torch is not None:
+                self.torch.export_chrome_trace(os.path.join(folder, 'torch_trace.json'))
+                archive.write(os.path.join(folder, 'torch_trace.json'), 'torch_trace.json')
+        return buffer.getvalue()
+
+
+class Profiler:
+    """Profiles the next N iterations of a running loop on request, and nothing outside that window"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+
+    def start(self, iterations, use_torch=True):
+        """Arm a session for the next iterations; raises RuntimeError if one is already running"""
+        with self.lock:
+            if self.session is not None:
+                raise RuntimeError("A profiling session is already running")
+            self.session = ProfileSession(iterations, use_torch)
+            return self.session
+
+    def cancel(self, session):
+        """Drop a session that never ran, or have the loop end it after its current iteration"""
+        with self.lock:
+            if self.session is session and session.started is None:
+                self.session = None
+                return
+        session.remaining = 0
+
+    @contextmanager
+    def iteration(self):
+        """Wrap one loop iteration; a no-op unless a session is armed"""
+        session = self.session
+        if session is None:
+            yield
+            return
+
+        if session.started is None:
+            session.begin()
+        session.python.enable()
+        try:
+            yield
+        finally:
+            session.python.disable()
+            session.remaining -= 1
+            if session.remaining <= 0:
+                with self.lock:
+                    if self.session is session:
+                        self.session = None
+                        session.finish()
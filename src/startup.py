@@ -0,0 +1,54 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Startup:
+    """Startup phases with their timings and the readiness of each component, as reported by /health and /ready"""
+
+    def __init__(self, components=()):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.phases = {}  # phase name -> state, seconds and error
+        self.components = {name: False for name in components}
+        self.finished = None  # seconds from start until every component was ready
+
+    @contextmanager
+    def phase(self, name):
+        """Time a startup step; a failure is recorded with its error and re-raised"""
+        start = time.perf_counter()
+        with self.lock:
+            self.phases[name] = {'state': 'running', 'start': round(start - self.started, 3)}
+        try:
+            yield
+        except Exception as exc:
+            self.end(name, start, 'failed', f'{type(exc).__name__}: {exc}')
+            raise
+        self.end(name, start, 'done')
+
+    def end(self, name, start, state, error=None):
+        with self.lock:
+            self.phases[name].update(state=state, seconds=round(time.perf_counter() - start, 3))
+            if error:
+                self.phases[name]['error'] = error
+
+    def set_ready(self, component, ready=True):
+        with self.lock:
+            self.components[component] = ready
+            if self.finished is None and all(self.components.values()):
+                self.finished = round(time.perf_counter() - self.started, 3)
+
+    @property
+    def failed(self):
+        return any(phase['state'] == 'failed' for phase in list(self.phases.values()))
+
+    @property
+    def ready(self):
+        with self.lock:
+            return all(self.components.values()) and not self.failed
+
+    def report(self):
+        status = 'failed' if self.failed else 'ready' if self.ready else 'starting'
+        with self.lock:
+            return {'status': status, 'components': dict(self.components), 'phases': dict(self.phases),
+                    'startup_seconds': self.finished, 'uptime': round(time.perf_counter() - self.started, 3)}
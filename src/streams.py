@@ -0,0 +1,68 @@
+from src.broadcast import FrameBroadcaster
+from src.camera import Camera
+from src.config import classify_changes
+from src.doors import DoorDispatcher
+from src.motion import MotionGate
+from src.utils import Connection
+
+
+class Stream:
+    """One camera with its turnstile zones, door target, motion gate and video feed"""
+
+    def __init__(self, name, config, stop_event):
+        self.name = name
+        self.config = config
+        self.stop_event = stop_event
+        self.camera = Camera(config, stop_event)
+        self.connection = Connection(config)
+        self.doors = DoorDispatcher(name, stop_event)
+        self.motion_gate = MotionGate(config)
+        # Outlives camera swaps, so connected viewers keep their feed
+        self.broadcaster = FrameBroadcaster(config['camera'].get('feed', {}), stop_event, name)
+        # Replaced cameras, released by the capture stage between reads since it may still be reading one
+        self.retired = []
+        # Pipeline buffers, set when the stream's stages are built
+        self.frames = None
+        self.detections = None
+        self.overlays = None
+
+    def prepare(self, config):
+        """Build what a config change needs (new device or door connection) without touching the live stream"""
+        changes = classify_changes(self.config, config)
+        camera = Camera(config, self.stop_event) if 'camera' in changes else self.camera
+        connection = Connection(config) if 'connection' in changes else self.connection
+        return config, changes, camera, connection
+
+    def discard(self, prepared):
+        """Release a prepared camera that will not be committed"""
+        camera = prepared[2]
+        if camera is not self.camera:
+            camera.release()
+
+    def commit(self, prepared):
+        """Swap prepared components in (call with the state lock held); a replaced camera is retired"""
+        config, changes, camera, connection = prepared
+        old_camera = self.camera
+        self.config, self.camera, self.connection = config, camera, connection
+        connection.config = config
+        if camera is old_camera:
+            camera.apply_config(config)
+        if changes & {'motion', 'camera'}:
+            self.motion_gate.apply_config(config)
+        if 'feed' in changes:
+            self.broadcaster.apply_config(config['camera'].get('feed', {}))
+        if camera is not old_camera:
+            self.retired.append(old_camera)
+
+    def release_retired(self):
+        """Release the replaced cameras; call from the thread that reads the camera, or when nothing reads it"""
+        while self.retired:
+            self.retired.pop().release()
+
+    def release(self, camera=True, doors=True):
+        """Close the door dispatcher and release the cameras, skipping what a still running stage uses"""
+        if doors:
+            self.doors.close()
+        if camera:
+            self.release_retired()
+            self.camera.release()
@@ -0,0 +1,128 @@
+import itertools
+
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Intersection over union between every pair of [x1, y1, x2, y2] boxes"""
+    a = np.asarray(boxes_a, dtype=float).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=float).reshape(-1, 4)[None, :, :]
+    w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+def centers(boxes):
+    """Center points of [x1, y1, x2, y2] boxes"""
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+
+class Track:
+    """A face followed across frames, with the identity from its last embedding"""
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.user_id = 0
+        self.distance = np.inf
+        self.frames_since_embedding = None  # None until the first embedding
+        self.missed = 0
+
+
+class FaceTracker:
+    """Associates detections across frames and decides which faces need a fresh embedding"""
+
+    def __init__(self, iou_threshold=0.3, centroid_threshold=0.5, refresh_frames=30, unknown_refresh_frames=3,
+                 low_confidence=0.8, max_missed=5):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold  # max centroid shift, relative to the face size
+        self.refresh_frames = refresh_frames  # re-embed confident faces this often
+        self.unknown_refresh_frames = unknown_refresh_frames  # and unknown or low confidence ones this often
+        self.low_confidence = low_confidence  # fraction of the threshold above which a match is low confidence
+        self.max_missed = max_missed
+        self.tracks = []
+        self.ids = itertools.count(1)
+        self.faces_seen = 0
+        self.embeddings_computed = 0
+
+    def associate(self, boxes):
+        """Pair detections with existing tracks by IoU, falling back to centroid distance"""
+        pairs = {}
+        if not self.tracks or not len(boxes):
+            return pairs
+        track_boxes = np.array([track.box for track in self.tracks])
+        iou = iou_matrix(track_boxes, boxes)
+
+        # Greedy matching on IoU, best pairs first
+        for t, b in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+            if iou[t, b] < self.iou_threshold:
+                break
+            if t not in pairs.values() and b not in pairs:
+                pairs[b] = t
+
+        # Fast movers have no overlap with their previous box, so try nearby centroids
+        sizes = np.maximum(track_boxes[:, 2] - track_boxes[:, 0], track_boxes[:, 3] - track_boxes[:, 1])
+        shift = np.linalg.norm(centers(track_boxes)[:, None] - centers(np.asarray(boxes, dtype=float))[None],
+                               axis=2) / np.maximum(sizes, 1e-9)[:, None]
+        for b in range(len(boxes)):
+            if b in pairs:
+                continue
+            for t in np.argsort(shift[:, b]):
+                if shift[t, b] > self.centroid_threshold:
+                    break
+                if t not in pairs.values():
+                    pairs[b] = t
+                    break
+        return pairs
+
+    def update(self, boxes, threshold):
+        """Advance tracks with this frame's boxes; return tracks per box and indices of boxes to embed"""
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        pairs = self.associate(boxes)
+
+        tracks, to_embed = [], []
+        for b, box in enumerate(boxes):
+            track = self.tracks[pairs[b]] if b in pairs else Track(next(self.ids), box)
+            track.box, track.missed = box, 0
+            if self.needs_embedding(track, threshold):
+                to_embed.append(b)
+            elif track.frames_since_embedding is not None:
+                track.frames_since_embedding += 1
+            tracks.append(track)
+
+        matched = set(pairs.values())
+        for t, track in enumerate(self.tracks):
+            if t not in matched:
+                track.missed += 1
+                if track.missed <= self.max_missed:
+                    tracks.append(track)
+        self.tracks = tracks
+        self.faces_seen += len(boxes)
+        self.embeddings_computed += len(to_embed)
+        return tracks[:len(boxes)], to_embed
+
+    def needs_embedding(self, track, threshold):
+        if track.frames_since_embedding is None:
+            return True
+        confident = track.user_id != 0 and track.distance < threshold * self.low_confidence
+        interval = self.refresh_frames if confident else self.unknown_refresh_frames
+        return track.frames_since_embedding + 1 >= interval
+
+    def assign(self, track, user_id, distance):
+        """Record the identity from a fresh embedding"""
+        track.user_id, track.distance, track.frames_since_embedding = user_id, distance, 0
+
+    def invalidate(self):
+        """Force every track to be re-embedded, e.g. after the gallery changed"""
+        for track in self.tracks:
+            track.frames_since_embedding = None
+
+    def stats(self):
+        return {
+            'tracks': len(self.tracks),
+            'faces_seen': self.faces_seen,
+            'embeddings_computed': self.embeddings_computed,
+        }
@@ -1,10 +1,10 @@
 import json
 import logging
+import time
 from datetime import datetime
 from enum import Enum
 from typing import Dict, Optional
 
-import pandas as pd
 import requests
 from requests import RequestException
 
@@ -45,7 +45,14 @@ class Connection:
         self.host = self.connection_config["host"]
         self.login = self.connection_config["login"]
         self.password = self.connection_config["password"]
-
+        self.timeout = self.connection_config.get("timeout", 5)  # seconds per HTTP call
+        self.retries = self.connection_config.get("retries", 2)  # extra attempts for a door command
+        self.backoff = self.connection_config.get("backoff", 0.2)  # seconds before the first retry, doubled after
+        self.token_ttl = self.connection_config.get("token_ttl", 600)  # seconds before the token is refreshed
+        self.max_age = self.connection_config.get("max_age", 3)  # seconds a queued door command stays valid
+
+        self.session = requests.Session()  # keep-alive connection pool to the controller
+        self.token_time = None
         self.headers = {
             "Content-type": "application/json; charset=UTF-8",
             "Authorization": "Bearer null"
@@ -55,15 +62,11 @@ class Connection:
             'direction': 0,
             'time': datetime.now()
         }
-        self.directions = {
-            DoorState.ENTRANCE: "Entrance",
-            DoorState.EXIT: "Exit"
-        }
 
     def _request(self, method: str, path: str, **kwargs) -> requests.Response:
         url = f'http://{self.host}{path}'
         try:
-            response = requests.request(method, url, headers=self.headers, timeout=5, **kwargs)
+            response = self.session.request(method, url, headers=self.headers, timeout=self.timeout, **kwargs)
             response.raise_for_status()
         except RequestException as exc:
             if logger:
@@ -89,6 +92,12 @@ class Connection:
 
     def set_headers(self):
         self.headers["Authorization"] = f"Bearer {self.getToken()}"
+        self.token_time = time.monotonic()
+
+    def ensure_token(self):
+        """Fetch a token if there is none yet or it is older than token_ttl, before a call needs it"""
+        if self.token_time is None or time.monotonic() - self.token_time > self.token_ttl:
+            self.set_headers()
 
     def read_users(self) -> Dict[int, str]:
         url = "/api/users/staff/list"
@@ -125,45 +134,52 @@ class Connection:
             raise RuntimeError("Invalid pass response payload") from exc
         return data.get('result') == 'ok'
 
-    def open_doors(self, id, direction: DoorState, user_name: str):
-        if logger:
-            logger.info('%s door opened for %s', self.directions[direction], user_name)
+    def is_repeat(self, id) -> bool:
+        """True if the last recorded command was for the same user within min_time_diff seconds"""
         time_diff = (datetime.now() - self.previous_state['time']).total_seconds()
-
-        if id != self.previous_state['id'] or time_diff > self.config["turnstiles"]["min_time_diff"]:
-            self.previous_state['id'] = id
-            self.previous_state['direction'] = direction
-            self.previous_state['time'] = datetime.now()
+        return id == self.previous_state['id'] and time_diff <= self.config["turnstiles"]["min_time_diff"]
+
+    def record_open(self, id, direction: DoorState):
+        """Remember an accepted command for the min_time_diff check"""
+        self.previous_state['id'] = id
+        self.previous_state['direction'] = direction
+        self.previous_state['time'] = datetime.now()
+
+    def notify_pass(self, id, direction: DoorState, deadline=None) -> bool:
+        """Send the pass command with up to `retries` retries and backoff, not after `deadline`; True if accepted"""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            if deadline is not None and time.perf_counter() > deadline:
+                return False  # the person has left the zone by now, opening the door would be a security risk
             try:
-                success = self.passing(int(id), direction.value, f'{direction.name} door')
-            except RuntimeError as exc:
+                self.ensure_token()
+                if self.passing(int(id), direction.value, f'{direction.name} door'):
+                    return True
                 if logger:
-                    logger.error("Failed to notify door opening: %s", exc)
-                return
-
-            if not success:
+                    logger.warning('Door open request rejected, refreshing token (attempt %d)', attempt + 1)
+                self.token_time = None
+            except RuntimeError as exc:
+                response = getattr(exc.__cause__, 'response', None)
+                if response is not None and response.status_code in (401, 403):
+                    self.token_time = None
                 if logger:
-                    logger.warning('Authorization token expired, refreshing and retrying')
-                try:
-                    self.set_headers()
-                    success = self.passing(int(id), direction.value, f'{direction.name} door')
-                except RuntimeError as exc:
-                    if logger:
-                        logger.error("Retry failed to notify door opening: %s", exc)
-                    return
-                if not success and logger:
-                    logger.error('Door open request rejected after token refresh')
+                    logger.error("Failed to notify door opening (attempt %d): %s", attempt + 1, exc)
+        return False
 
 
 def get_connection(config) -> Connection:
     global connection
-    if connection:
+    if connection and connection.connection_config == config['connection']:
+        connection.config = config
         return connection
     connection = Connection(config)
     return connection
 
 
 def read_excel(file):
+    import pandas as pd  # imported on use, it takes a noticeable part of startup
+
     df = pd.read_excel(file)
     user_dict = {ind: name for ind, name in df.values}
     return user_dict